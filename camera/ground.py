@@ -5,32 +5,60 @@ Library of functions for checking whether or not ground truth is respected by
 a given set of signatures, noe network, and structure.
 """
 
-import itertools
+import numpy as np
 import networkx as nx
 from . import params
+from . import structures
 
 
-def check_network(network, structure):
+def check_network(network, structure, pool=None, processes=1):
     """
     Given an NOE network, a collection of signatures, and a structure, verify
     that a maximum cardinality matching of the network does not necessarily
-    violate the known assignments to the signatures
+    violate the known assignments to the signatures. Components are checked
+    in the given pool of processes, if any
     """
 
     # Restrict the network to its active edges
 
     network = network.active_graph()
 
+    # Look at the connected components of this graph through views rather
+    # than copies
+
+    components = [network.subgraph(nodes)
+                  for nodes in nx.connected_components(network)]
+
+    # Compute the minimum radius of each component. With a pool the
+    # components are split into one batch per process, but never into more
+    # batches than there are components. Edge lengths are memoized for the
+    # duration of this call only, since clusters and assignments may change
+    # between calls
+
+    memo = {}
+    batches = min(processes, len(components)) if pool is not None else 1
+
+    # Components sent to worker processes are copied into standalone graphs
+    # so that they can be pickled
+
+    if batches > 1:
+        size = -(-len(components) // batches)
+        tasks = [([nx.Graph(c) for c in components[k:k + size]], structure)
+                 for k in range(0, len(components), size)]
+        radii = [radius for results in pool.map(check_batch, tasks)
+                 for radius in results]
+
+    else:
+        radii = [check_component(c, structure, memo) for c in components]
+
     # Iterate over connected components of this graph
 
-    for component in nx.connected_component_subgraphs(network):
+    for component, min_radius in zip(components, radii):
 
         # Check whether this is a short component
 
         short = list(component.nodes())[0].short_range
 
-        min_radius = check_component(component, structure)
-
         problem = False
 
         if params.RADIUS < min_radius < float("inf"):
@@ -50,79 +78,243 @@ def check_network(network, structure):
             print()
 
             for i, j in component.edges():
-                length = check_edge(i, j, structure)
+                length = check_edge(i, j, structure, memo)
                 print(f"\tedge=({i}, {j}) min_length={length:.3f}")
             print()
 
 
-def check_component(component, structure):
+def check_batch(task):
+    """
+    Run check_component on each of a batch of components against the
+    structure, sharing one memo of edge lengths across the batch
+    """
+
+    components, structure = task
+    memo = {}
+
+    return [check_component(c, structure, memo) for c in components]
+
+
+def check_component(component, structure, memo=None):
     """
     Check whether any maximum cardinality matching of the given connected
-    component of the symmetrization graph can respect ground truth
+    component of the symmetrization graph can respect ground truth. Returns
+    the smallest radius for which some maximum cardinality matching has every
+    one of its edges within that radius. Edge lengths are kept in the given
+    memo dict, if any
     """
 
-    # Set the minimum observed distance of this component to be infinity
+    if memo is None:
+        memo = {}
+
+    # Compute the minimum length of each edge of the component once, and get
+    # the sorted list of distinct lengths to search over
+
+    lengths = {frozenset((i, j)): check_edge(i, j, structure, memo)
+               for i, j in component.edges()}
+    thresholds = sorted(set(lengths.values()))
+    rank = {t: idx for idx, t in enumerate(thresholds)}
+
+    if not thresholds:
+        return float("inf")
 
-    minimum = float("inf")
+    # Get a maximum cardinality matching of this component and its size
 
-    # Get the size of the maximum cardinality matching of this component
+    matching = max_cardinality_matching(component)
+    max_matching_size = len(matching)
 
-    max_matching_size = len(nx.max_weight_matching(component,
-                                                   maxcardinality=True))
+    # Binary search for the smallest threshold such that restricting the
+    # component to edges no longer than the threshold leaves the size of the
+    # maximum cardinality matching unchanged. Every maximum matching found
+    # along the way is a witness for its own longest edge, so the upper end
+    # of the search drops straight to that edge rather than to the probe.
 
-    # Iterate over all subsets of edges of the component that are the same
-    # size as the maximum cardinality matching
+    low = 0
+    high = max(rank[lengths[frozenset(e)]] for e in matching)
 
-    for matching in itertools.combinations(component.edges(),
-                                           max_matching_size):
+    while low < high:
 
-        # Check that this is in fact a matching
+        middle = (low + high) // 2
 
-        if nx.is_matching(component, matching):
+        subgraph = component.edge_subgraph(
+            [tuple(e) for e in lengths if lengths[e] <= thresholds[middle]])
 
-            # Use helper to compute the minimum length edge of this matching
+        matching = max_cardinality_matching(subgraph)
 
-            minimum = min(minimum, check_matching(matching, structure))
+        if len(matching) == max_matching_size:
+            high = max(rank[lengths[frozenset(e)]] for e in matching)
 
-    # Return the minimum observed distance for this component
+        else:
+            low = middle + 1
 
-    return minimum
+    # Return the minimum radius at which this component respects ground truth
 
+    return thresholds[low]
 
-def check_matching(matching, structure):
+
+def max_cardinality_matching(graph):
     """
-    Check whether a given matching, i.e. set of edges of the network, can be
-    activated while respecting ground truth
+    Return a maximum cardinality matching of the graph as a set of edges.
+    Small bipartite graphs, as most components of the symmetrization graph
+    are, are matched by augmenting paths over integer adjacency lists, and
+    any other graph by networkx
     """
 
-    return min([check_edge(i, j, structure) for i, j in matching])
+    nodes = list(graph.nodes())
+
+    if len(nodes) > 64:
+        return nx.max_weight_matching(graph, maxcardinality=True)
+
+    # Number the vertices and list the neighbors of each
+
+    index = {n: k for k, n in enumerate(nodes)}
+    adjacency = [[index[m] for m in graph.neighbors(n)] for n in nodes]
+
+    # Split the vertices into two sides, leaving graphs with an odd cycle to
+    # networkx
+
+    side = [-1] * len(nodes)
+
+    for root in range(len(nodes)):
+
+        if side[root] >= 0:
+            continue
+
+        side[root] = 0
+        queue = [root]
+
+        for u in queue:
+            for v in adjacency[u]:
+                if side[v] < 0:
+                    side[v] = 1 - side[u]
+                    queue.append(v)
+                elif side[v] == side[u]:
+                    return nx.max_weight_matching(graph, maxcardinality=True)
+
+    # Grow the matching by searching for an augmenting path from each vertex
+    # on the first side
+
+    mate = [-1] * len(nodes)
+
+    def augment(u, seen):
+
+        for v in adjacency[u]:
+
+            if seen[v]:
+                continue
+
+            seen[v] = True
 
+            if mate[v] < 0 or augment(mate[v], seen):
+                mate[u], mate[v] = v, u
+                return True
 
-def check_edge(alpha, beta, structure):
+        return False
+
+    for u in range(len(nodes)):
+        if side[u] == 0:
+            augment(u, [False] * len(nodes))
+
+    return {(nodes[u], nodes[mate[u]]) for u in range(len(nodes))
+            if side[u] == 0 and mate[u] >= 0}
+
+
+def check_edge(alpha, beta, structure, memo=None):
     """
     Check whether a given edge of the symmetrization graph violates ground
-    truth
+    truth. Lengths are kept in the given memo dict, if any, so the clusters
+    of the NOEs and the assignments of their signatures must not change
+    while it is in use
+    """
+
+    if memo is None:
+        memo = {}
+
+    # The minimum distance does not depend on the order of the endpoints, so
+    # put them in a canonical order to share one memo entry per edge
+
+    if beta.label < alpha.label:
+        alpha, beta = beta, alpha
+
+    key = ("edge", alpha, beta)
+
+    if key not in memo:
+        memo[key] = edge_length(alpha, beta, structure, memo)
+
+    return memo[key]
+
+
+def edge_length(alpha, beta, structure, memo):
+    """
+    Return the minimum distance in the structure between any pair of distinct
+    methyls that the endpoints of the given edge can be assigned to, keeping
+    the methyls of each endpoint in the memo dict
+    """
+
+    # Get the dense distance matrix of the structure
+
+    _, matrix = structures.distance_matrix(structure)
+
+    # Get the indices of all methyls that each endpoint can be assigned to
+
+    alpha_idx = methyl_indices(alpha, structure, memo)
+    beta_idx = methyl_indices(beta, structure, memo)
+
+    # Skip the array work when either endpoint has no methyls, or when each
+    # endpoint has exactly one
+
+    if not alpha_idx.size or not beta_idx.size:
+        return float("inf")
+
+    if alpha_idx.size == 1 and beta_idx.size == 1:
+        if alpha_idx[0] == beta_idx[0]:
+            return float("inf")
+        return float(matrix[alpha_idx[0], beta_idx[0]])
+
+    # Get the distances between all pairs of distinct methyls
+
+    distances = matrix[np.ix_(alpha_idx, beta_idx)]
+    distances = distances[alpha_idx[:, None] != beta_idx[None, :]]
+
+    # Return the minimum, or infinity if there are no such pairs
+
+    return float(distances.min()) if distances.size else float("inf")
+
+
+def methyl_indices(noe, structure, memo):
     """
+    Return a sorted array of the distance matrix indices of all methyls that
+    an NOE can be assigned to through any of its clusters. Results are kept
+    per NOE in the memo dict, so they are computed once rather than once per
+    incident edge
+    """
+
+    key = ("noe", noe)
 
-    # Set the minimum distance to be infinity
+    if key not in memo:
 
-    minimum = float("inf")
+        arrays = [signature_indices(c, structure, memo) for c in noe.clusters]
 
-    # Iterate over all possible clusterings of the edge
+        if arrays:
+            memo[key] = np.unique(np.concatenate(arrays))
+        else:
+            memo[key] = np.empty(0, dtype=np.int32)
 
-    for alpha_cluster, beta_cluster in itertools.product(alpha.clusters,
-                                                         beta.clusters):
+    return memo[key]
 
-        # Iterate over all possible assignments of these clusters
 
-        for alpha_asg, beta_asg in itertools.product(alpha_cluster.asg,
-                                                     beta_cluster.asg):
+def signature_indices(signature, structure, memo):
+    """
+    Return a sorted array of the distance matrix indices of the methyls a
+    signature is assigned to. Results are kept per signature in the memo
+    dict, so they are shared by every NOE clustered to it
+    """
 
-            # If these assignments are not the same, check the distance
+    key = ("signature", signature)
 
-            if alpha_asg != beta_asg:
-                minimum = min(minimum,
-                              structure[alpha_asg][beta_asg]["distances"][0])
+    if key not in memo:
+        index, _ = structures.distance_matrix(structure)
+        memo[key] = np.array(sorted(index[m] for m in signature.asg),
+                             dtype=np.int32)
 
-    # Return the minimum
-    return minimum
+    return memo[key]
@@ -6,15 +6,23 @@ used in the methyl assignment problem.
 """
 
 import pandas
+import collections
 import shutil
-import itertools
 
 
 class Signature:
     """
-    Class representation of a 2D NMR peak
+    Class representation of a 2D NMR peak. Each label is read into exactly one
+    Signature, so signatures compare and hash by identity
     """
 
+    # Declare the fields of a Signature up front so that instances do not each
+    # carry a dictionary
+
+    __slots__ = ("label", "carbon", "hydrogen", "color", "geminal_str",
+                 "raw_assignment", "raw_options", "asg_labels",
+                 "option_labels", "asg", "options", "geminal")
+
     def __init__(self, source):
         """
         Construct self from source, which should be a pandas series from a
@@ -28,19 +36,83 @@ class Signature:
 
         # Extract all relevant fields from the dictionary, or use default
         # value if that fails
-        self.label = source["label"]
-        self.carbon = source["carbon"]
-        self.hydrogen = source["hydrogen"]
-        self.color = list(source.get("color", ""))
-        self.asg_str = source.get("assignment", "").split()
-        self.option_str = source.get("options", "").split()
-        self.geminal_str = source.get("geminal", "")
+        self.set_fields(source["label"], source["carbon"], source["hydrogen"],
+                        source.get("color", ""),
+                        source.get("assignment", ""),
+                        source.get("options", ""),
+                        source.get("geminal", ""))
+
+    @classmethod
+    def from_fields(cls, label, carbon, hydrogen, color="", assignment="",
+                    options="", geminal=""):
+        """
+        Construct a Signature directly from the values of its CSV columns,
+        without going through a pandas series
+        """
+
+        signature = cls.__new__(cls)
+        signature.set_fields(label, carbon, hydrogen, color, assignment,
+                             options, geminal)
+
+        return signature
+
+    def set_fields(self, label, carbon, hydrogen, color, assignment, options,
+                   geminal):
+        """
+        Set the fields of self from the values of its CSV columns
+        """
+
+        if not isinstance(assignment, str) or not isinstance(options, str):
+            raise TypeError("assignment and options must be strings")
+
+        self.label = label
+        self.carbon = carbon
+        self.hydrogen = hydrogen
+        self.color = list(color)
+        self.geminal_str = geminal
+
+        # Keep the assignment and options strings as they are, and only split
+        # them into labels when they are first needed
+        self.raw_assignment = assignment
+        self.raw_options = options
+        self.asg_labels = None
+        self.option_labels = None
 
         # Initialize fields that will be set later
         self.asg = []
         self.options = []
         self.geminal = []
 
+    @property
+    def asg_str(self):
+        """
+        The labels of the methyls named in the assignment field
+        """
+
+        if self.asg_labels is None:
+            self.asg_labels = self.raw_assignment.split()
+
+        return self.asg_labels
+
+    @asg_str.setter
+    def asg_str(self, labels):
+        self.asg_labels = labels
+
+    @property
+    def option_str(self):
+        """
+        The labels of the methyls named in the options field
+        """
+
+        if self.option_labels is None:
+            self.option_labels = self.raw_options.split()
+
+        return self.option_labels
+
+    @option_str.setter
+    def option_str(self, labels):
+        self.option_labels = labels
+
     def is_geminal(self, other):
         """
         Determine if this Signature and another form a geminal pair based on
@@ -68,23 +140,6 @@ class Signature:
                 "hydrogen": f"{self.hydrogen:.3f}",
                 "geminal": self.geminal.label if self.geminal else ""}
 
-    def __eq__(self, other):
-        """
-        Determine if this Signature object and another are equal
-        """
-
-        if not isinstance(other, Signature):
-            return False
-
-        return self.label == other.label
-
-    def __hash__(self):
-        """
-        Hash a Signature object
-        """
-
-        return hash(self.label)
-
     def __repr__(self):
         """
         How to print out a Signature object
@@ -108,16 +163,16 @@ def set_assignment(signatures, structure):
     CSV file
     """
 
-    # Get a set containing the nodes of the structure
-    methyls = set(structure.nodes)
+    # Get a dictionary mapping labels to the nodes of the structure
+    methyls = {m.label: m for m in structure.nodes}
 
     # Iterate over the signatures in the list
     for sig in signatures:
 
         # Update the assignment and options lists to contain the methyls
         # with labels in the asg_str and options_str fields respectively
-        sig.asg = {m for m in methyls if m.label in sig.asg_str}
-        sig.options = {m for m in methyls if m.label in sig.option_str}
+        sig.asg = {methyls[l] for l in sig.asg_str if l in methyls}
+        sig.options = {methyls[l] for l in sig.option_str if l in methyls}
 
 
 def to_csv(signatures, outfile):
@@ -145,17 +200,17 @@ def nailed_histogram(signatures, support=None):
 
     # Get support set sizes
 
-    sizes = [len(support[s]) for s in support if support[s]]
-    all_sizes = set(sizes)
+    sizes = collections.Counter(len(support[s]) for s in support
+                                if support[s])
 
     # Get maximum histogram bar size
     max_length = shutil.get_terminal_size()[0] - 20
 
-    # Iterate over all_sizes
-    for size in sorted(all_sizes):
+    # Iterate over the sizes in increasing order
+    for size in sorted(sizes):
 
-        print(f"[no.options={size:<2}]:{sizes.count(size):<3}", end="|")
-        print(min(sizes.count(size), max_length) * "\u25a7")
+        print(f"[no.options={size:<2}]:{sizes[size]:<3}", end="|")
+        print(min(sizes[size], max_length) * "\u25a7")
 
     # Figure out how many nailed there are
 
@@ -169,7 +224,7 @@ def nailed_histogram(signatures, support=None):
 
         elif len(sup) == 2:
 
-            left, right = list(sup)
+            left, right = sup
             if left.geminal(right):
                 nailed += 1
 
@@ -187,31 +242,58 @@ def parse_hmqc_file(filename):
     signatures = []
     csv = pandas.read_csv(filename)
 
-    for idx, row in csv.iterrows():
-        try:
-            signatures.append(Signature(row))
+    # Pull out each column as an array, using an empty string for missing
+    # optional fields and marking rows without a required field as invalid
+
+    required = ["label", "carbon", "hydrogen"]
+    valid = csv.reindex(columns=required).notna().all(axis=1).to_numpy()
+
+    columns = [csv[c].to_numpy() if c in csv else [None] * len(csv)
+               for c in required]
+    columns += [csv[c].fillna("").to_numpy() if c in csv else [""] * len(csv)
+                for c in ["color", "assignment", "options", "geminal"]]
+
+    for idx, fields in enumerate(zip(*columns)):
+
+        if valid[idx]:
+            try:
+                signatures.append(Signature.from_fields(*fields))
+                continue
+
+            # Optional fields of the wrong type cannot be split or listed
+            except (TypeError, AttributeError):
+                pass
+
+        print(f"warning: invalid HMQC peak definition on line {idx + 1} "
+              f"of {filename}")
+
+    # Determine which pairs of signatures are known to be geminal pairs by
+    # looking up the label named in each geminal field
+
+    by_label = {s.label: idx for idx, s in enumerate(signatures)}
+    pairs = set()
+
+    for idx, s in enumerate(signatures):
+        partner = by_label.get(s.geminal_str)
+        if partner is not None and partner != idx:
+            pairs.add((min(idx, partner), max(idx, partner)))
 
-        except:
-            print(f"warning: invalid HMQC peak definition on line {idx + 1} "
-                  f"of {filename}")
+    for a, b in sorted(pairs):
 
-    # Determine which pairs of signatures are known to be geminal pairs
-    for i, j in itertools.combinations(signatures, 2):
-        if i.geminal_str == j.label or j.geminal_str == i.label:
+        i, j = signatures[a], signatures[b]
 
-            # Set these to be each others geminal pair
-            print(f"Setting {i} and {j} as a geminal pair")
-            i.geminal = j
-            j.geminal = i
+        # Set these to be each others geminal pair
+        print(f"Setting {i} and {j} as a geminal pair")
+        i.geminal = j
+        j.geminal = i
 
     # Print out a histogram of the number of types
 
     print()
-    type = ["".join(sorted(s.color)) for s in signatures]
-    all_types = set(type)
+    type = collections.Counter("".join(sorted(s.color)) for s in signatures)
 
-    for t in sorted(all_types):
-        print(f"Read {type.count(t)} signatures of color {t}")
+    for t in sorted(type):
+        print(f"Read {type[t]} signatures of color {t}")
 
     print()
     return signatures
@@ -8,8 +8,10 @@ problem
 
 import pandas
 import shutil
+import collections
 import itertools
 import networkx as nx
+from . import noes
 
 
 class SignatureGraph(nx.Graph):
@@ -46,11 +48,14 @@ class SignatureGraph(nx.Graph):
                               short=i.short_range)
 
         # Iterate over geminal pairs of signatures and add geminal edges
-        # between them
+        # between them, finding each pair from the geminal field of its first
+        # signature rather than testing every pair
 
-        for i, j in itertools.combinations(signatures, 2):
-            if i.is_geminal(j):
-                self.add_edge(i, j, geminal=True, short=True)
+        position = {s: idx for idx, s in enumerate(signatures)}
+
+        for idx, i in enumerate(signatures):
+            if i.geminal and position.get(i.geminal, -1) > idx:
+                self.add_edge(i, i.geminal, geminal=True, short=True)
 
 
 class SymGraph(nx.Graph):
@@ -69,8 +74,16 @@ class SymGraph(nx.Graph):
         # Call the nx.Graph constructor to initialize parent class fields
         nx.Graph.__init__(self)
 
-        # Save the type of this dataset
-        self.type = list({s.type for s in source})[0]
+        # Initialize the sets of active and dead edges, where each edge is
+        # stored as a frozenset of its endpoints, and the cache of the living,
+        # active, and inactive graphs derived from them
+
+        self.active = set()
+        self.dead = set()
+        self.cache = {}
+
+        # Save the type of this dataset, which is shared by all of its NOEs
+        self.type = next(iter(source)).type if source else None
 
         # Add all noes from source as vertices of the graph
         self.add_nodes_from(source)
@@ -81,19 +94,17 @@ class SymGraph(nx.Graph):
 
         for i in self.nodes():
             for j in i.reciprocals:
-                self.add_edge(i, j, active=False, dead=False)
+                self.add_edge(i, j)
 
         # Add an edge between all pairs of vertices which are symmetric. The
         # definition of symmetry is given in the Noe class in noes.py
 
         if find_symmetries:
-            for i, j in itertools.combinations(source, 2):
 
-                if i.reciprocals or j.reciprocals:
-                    continue
+            candidates = [n for n in source if not n.reciprocals]
 
-                if i.symmetric(j):
-                    self.add_edge(i, j, active=False, dead=False)
+            for idx, jdx in noes.symmetric_pairs(candidates):
+                self.add_edge(candidates[idx], candidates[jdx])
 
     def activate(self, i, j):
         """
@@ -102,7 +113,9 @@ class SymGraph(nx.Graph):
         """
 
         if self.has_edge(i, j):
-            self[i][j]["active"] = True
+            self.active.add(frozenset((i, j)))
+            self.cache.pop("active", None)
+            self.cache.pop("inactive", None)
 
         else:
             raise ValueError(f"No edge between {i} and {j}")
@@ -114,7 +127,9 @@ class SymGraph(nx.Graph):
         """
 
         if self.has_edge(i, j):
-            self[i][j]["active"] = False
+            self.active.discard(frozenset((i, j)))
+            self.cache.pop("active", None)
+            self.cache.pop("inactive", None)
 
         else:
             raise ValueError(f"No edge between {i} and {j}")
@@ -126,7 +141,8 @@ class SymGraph(nx.Graph):
         """
 
         if self.has_edge(i, j):
-            self[i][j]["dead"] = True
+            self.dead.add(frozenset((i, j)))
+            self.cache.clear()
 
         else:
             raise ValueError(f"No edge between {i} and {j}")
@@ -136,51 +152,61 @@ class SymGraph(nx.Graph):
         Return a copy of the graph with all of the edges that are dead removed
         """
 
-        # Create a copy of this graph
-        copy = self.copy()
+        if "living" not in self.cache:
 
-        # Remove all edges which are dead
-        copy.remove_edges_from([(i, j) for i, j in self.edges()
-                                if self[i][j]["dead"]])
+            # Create a new graph containing all nodes and living edges
+            graph = nx.Graph()
+            graph.add_nodes_from(self.nodes())
+            graph.add_edges_from(e for e in self.edges()
+                                 if frozenset(e) not in self.dead)
 
-        # Return the copy with the dead edges removed
-        return copy
+            # Save a frozen copy so that it may be shared between callers
+            self.cache["living"] = nx.freeze(graph)
+
+        # Return the graph with the dead edges removed
+        return self.cache["living"]
 
     def active_graph(self):
         """
         Return a copy of the graph in which only active edges remain
         """
 
-        # Get a copy of this graph with only the living edges
-        copy = self.living_graph()
-
-        # Remove all edges which are inactive
-        copy.remove_edges_from([(i, j) for i, j in self.edges()
-                                if not self[i][j]["active"]])
-
-        # Remove vertices of degree 0 from the graph
-        copy.remove_nodes_from([n for n in copy.nodes() if not copy.degree(n)])
+        if "active" not in self.cache:
+            included = self.active - self.dead
+            self.cache["active"] = self.edge_graph(
+                e for e in self.edges() if frozenset(e) in included)
 
-        # Return the copy with only active edges
-        return copy
+        # Return the graph with only active edges
+        return self.cache["active"]
 
     def inactive_graph(self):
         """
         Return a copy of the graph in which only inactive edges remain
         """
 
-        # Get a copy of this graph with only the living edges
-        copy = self.living_graph()
+        if "inactive" not in self.cache:
+            excluded = self.active | self.dead
+            self.cache["inactive"] = self.edge_graph(
+                e for e in self.edges() if frozenset(e) not in excluded)
 
-        # Remove all edges which are active
-        copy.remove_edges_from([(i, j) for i, j in self.edges()
-                                if self[i][j]["active"]])
+        # Return the graph with only inactive edges
+        return self.cache["inactive"]
 
-        # Remove vertices of degree 0 from the graph
-        copy.remove_nodes_from([n for n in copy.nodes() if not copy.degree(n)])
+    def edge_graph(self, edges):
+        """
+        Return a frozen graph made up of the given edges of this graph, in
+        their order and orientation, and the vertices incident to them
+        """
+
+        edges = list(edges)
+        endpoints = {n for e in edges for n in e}
 
-        # Return the copy with only active edges
-        return copy
+        # Add the vertices in the same order as they appear in this graph
+        graph = nx.Graph()
+        graph.add_nodes_from(n for n in self.nodes() if n in endpoints)
+        graph.add_edges_from(edges)
+
+        return nx.freeze(graph)
 
     def set_activity_level(self, max_size):
         """
@@ -192,17 +218,22 @@ class SymGraph(nx.Graph):
         living_graph = self.living_graph()
 
         # Iterate over connected components of the living graph
-        for component in nx.connected_component_subgraphs(living_graph):
+        for nodes in nx.connected_components(living_graph):
+
+            # Every edge incident to a component lies within it
+            edges = (frozenset(e) for e in living_graph.edges(nodes))
 
             # If the component has few enough vertices, active all edges.
             # Otherwise, deactivate all edges.
-            if component.number_of_nodes() <= max_size:
-                for i, j in component.edges():
-                    self[i][j]["active"] = True
+            if len(nodes) <= max_size:
+                self.active.update(edges)
 
             else:
-                for i, j in component.edges():
-                    self[i][j]["active"] = False
+                self.active.difference_update(edges)
+
+        # Forget the active and inactive graphs
+        self.cache.pop("active", None)
+        self.cache.pop("inactive", None)
 
     def ignore_geminals(self, signatures):
         """
@@ -238,14 +269,14 @@ class SymGraph(nx.Graph):
             for node in i_rec_matches + j_rec_matches:
                 for neighbor in self.neighbors(node):
 
-                    if self[node][neighbor]["dead"]:
+                    if frozenset((node, neighbor)) in self.dead:
                         continue
 
                     print(f"Removing symmetry between {node} and {neighbor} "
                           f"due to geminality")
 
-                    self[node][neighbor]["active"] = False
-                    self[node][neighbor]["dead"] = True
+                    self.deactivate(node, neighbor)
+                    self.kill(node, neighbor)
 
         print()
 
@@ -259,20 +290,20 @@ class SymGraph(nx.Graph):
 
         living_graph = self.living_graph()
 
-        # Iterate over the nodes and them to running dict list
+        # Record the living neighbors of each node without known reciprocals
+        # as its reciprocals
 
-        dictionaries = []
-        for n in self.nodes():
+        adjacency = living_graph.adj
 
-            if not n.reciprocals:
-                if living_graph.has_node(n):
-                    n.reciprocals = list(living_graph.neighbors(n))
+        nodes = list(self.nodes())
+        for n in nodes:
 
-            dictionaries.append(n.to_dict())
+            if not n.reciprocals and n in adjacency:
+                n.reciprocals = list(adjacency[n])
 
-        # Write out to CSV file
+        # Build the CSV table column by column
 
-        csv = pandas.DataFrame(dictionaries)
+        csv = pandas.DataFrame(noes.to_columns(nodes))
 
         # If the data type is 4D, we add the h1 column
 
@@ -297,10 +328,9 @@ class SymGraph(nx.Graph):
         # Get the living sym graph and the connected component sizes
 
         living_graph = self.living_graph()
-        sizes = [component.number_of_nodes() for component
-                 in nx.connected_component_subgraphs(living_graph)]
-        all_sizes = set(sizes)
-        counts = {s: sizes.count(s) for s in all_sizes}
+        sizes = collections.Counter(len(nodes) for nodes
+                                    in nx.connected_components(living_graph))
+        counts = dict(sizes)
 
         # Get the maximum line length from the size of the current terminal
         # window
@@ -309,18 +339,18 @@ class SymGraph(nx.Graph):
 
         # Get the largest count and scale down all counts to proportion
 
-        max_count = max(sizes.count(s) for s in all_sizes)
+        max_count = max(sizes.values())
 
         if max_count > max_length:
 
             counts = {s: max(1, int(counts[s]*max_length/max_count))
                       for s in counts}
 
-        # Iterate over all_sizes
+        # Iterate over the sizes in increasing order
 
-        for size in sorted(all_sizes):
+        for size in sorted(sizes):
 
-            print(f"[no.comp.of.size={size:<2}]:{sizes.count(size):<3}",
+            print(f"[no.comp.of.size={size:<2}]:{sizes[size]:<3}",
                   end="|")
             print(counts[size]*"\u25a7")
 
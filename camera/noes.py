@@ -6,8 +6,8 @@ This file contains an object oriented representation of an NOE, either in
 2D peaks, or signatures, which are implemented in hmqc.py
 """
 
+import numpy as np
 import pandas
-import itertools
 from . import params
 
 
@@ -18,6 +18,13 @@ class Noe:
     possible identities of the participants and reciprocals of the NOE
     """
 
+    # Declare the fields of an NOE up front so that instances do not each
+    # carry a dictionary
+
+    __slots__ = ("label", "c1", "c2", "h1", "h2", "intensity", "cluster_str",
+                 "reciprocal_str", "short_range", "type", "clusters",
+                 "reciprocals")
+
     def __init__(self, source):
         """
         Construct an NOE object from a pandas series which contains all of
@@ -32,15 +39,43 @@ class Noe:
 
         # Get necessary features from this NOE
 
-        self.label = source.get("label", "")
-        self.c2 = source["c2"]
-        self.h2 = source["h2"]
-        self.h1 = source.get("h1", None)
-        self.c1 = source.get("c1", None)
-        self.intensity = source.get("intensity", 0.)
-        self.cluster_str = source.get("cluster", "").split()
-        self.reciprocal_str = source.get("reciprocals", "").split()
-        self.short_range = bool(source.get("short", False))
+        self.set_fields(source.get("label", ""), source.get("c1", None),
+                        source["c2"], source.get("h1", None), source["h2"],
+                        source.get("intensity", 0.),
+                        source.get("cluster", ""),
+                        source.get("reciprocals", ""),
+                        source.get("short", False))
+
+    @classmethod
+    def from_fields(cls, label, c1, c2, h1, h2, intensity=0., cluster="",
+                    reciprocals="", short=False):
+        """
+        Construct an NOE directly from the values of its CSV columns, with
+        None for missing coordinates, without going through a pandas series
+        """
+
+        noe = cls.__new__(cls)
+        noe.set_fields(label, c1, c2, h1, h2, intensity, cluster, reciprocals,
+                       short)
+
+        return noe
+
+    def set_fields(self, label, c1, c2, h1, h2, intensity, cluster,
+                   reciprocals, short):
+        """
+        Set the fields of self from the values of its CSV columns, raising a
+        Warning if this NOE is a diagonal
+        """
+
+        self.label = label
+        self.c2 = c2
+        self.h2 = h2
+        self.h1 = h1
+        self.c1 = c1
+        self.intensity = intensity
+        self.cluster_str = cluster.split() if cluster else ()
+        self.reciprocal_str = reciprocals.split() if reciprocals else ()
+        self.short_range = bool(short)
 
         # Determine the type of this NOE
 
@@ -102,86 +137,119 @@ class Noe:
         symmetrization tolerances
         """
 
-        # If these are NOEs from different experiments, return False
-        if self.type != other.type:
+        # If the other object is not an NOE, or these are NOEs from different
+        # experiments or ranges, return False
+        if not isinstance(other, Noe):
             return False
 
-        if self.short_range != other.short_range:
+        if self.type != other.type or self.short_range != other.short_range:
             return False
 
-        elif self.type == "CCH":
-            return (abs(self.c1 - other.c2) < params.SYM_CTOL
-                    and abs(self.c2 - other.c1) < params.SYM_CTOL)
+        # Read the tolerances once per call, since they may be changed at run
+        # time through params
+        ctol, htol = params.SYM_CTOL, params.SYM_HTOL
+
+        if self.type == "CCH":
+            return (abs(self.c1 - other.c2) < ctol
+                    and abs(self.c2 - other.c1) < ctol)
 
         elif self.type == "HCH":
-            return (abs(self.h1 - other.h2) < params.SYM_HTOL
-                    and abs(self.h2 - other.h1) < params.SYM_HTOL)
+            return (abs(self.h1 - other.h2) < htol
+                    and abs(self.h2 - other.h1) < htol)
 
         # Check for 4D NOE Symmetry, which relies on all coordinates
         else:
-            return (abs(self.h1 - other.h2) < params.SYM_HTOL
-                    and abs(self.h2 - other.h1) < params.SYM_HTOL
-                    and abs(self.c1 - other.c2) < params.SYM_CTOL
-                    and abs(self.c2 - other.c1) < params.SYM_CTOL)
+            return (abs(self.h1 - other.h2) < htol
+                    and abs(self.h2 - other.h1) < htol
+                    and abs(self.c1 - other.c2) < ctol
+                    and abs(self.c2 - other.c1) < ctol)
 
-    def set_clusters(self, signatures):
+    def to_dict(self):
         """
-        Given a list of signatures, set this Noes clusters field to be all
-        signatures which are within the clustering tolerance of itself
+        Return a dictionary representation of this Noe
         """
 
-        # Reset my list of clusters to be empty
-        self.clusters = {}
+        # Take the single row of the column representation of this NOE
 
-        def clusterable(sig):
-            return (abs(sig.carbon - self.c2) < params.CLS_CTOL
-                    and abs(sig.hydrogen - self.h2) < params.CLS_HTOL)
+        columns = to_columns([self])
+        dictionary = {key: values[0] for key, values in columns.items()}
 
-        # Filter down to signatures within range
-        signatures = filter(clusterable, signatures)
-        self.clusters = list(signatures)
+        if self.type != "4D":
+            del dictionary["h1"]
 
-    def to_dict(self):
-        """
-        Return a dictionary representation of this Noe
-        """
+        return dictionary
 
-        if self.reciprocals:
-            self.reciprocal_str = [n.label for n in self.reciprocals]
 
-        if self.clusters:
-            self.cluster_str = [n.label for n in self.clusters]
+def to_columns(noes):
+    """
+    Return a dictionary mapping each CSV column name to the list of values of
+    that column for the given NOEs, in order. The reciprocal and cluster
+    fields of each NOE are first updated from its reciprocals and clusters
+    """
 
-        dictionary = {"label": self.label,
-                      "intensity": self.intensity,
-                      "c1": self.c1, "c2": self.c2, "h2": self.h2,
-                      "reciprocals": " ".join(self.reciprocal_str),
-                      "clusters": " ".join(self.cluster_str),
-                      "short": "x" if self.short_range else ""}
+    for n in noes:
 
-        if self.type == "4D":
-            dictionary["h1"] = self.h1
+        if n.reciprocals:
+            n.reciprocal_str = [r.label for r in n.reciprocals]
 
-        return dictionary
+        if n.clusters:
+            n.cluster_str = [c.label for c in n.clusters]
+
+    return {"label": [n.label for n in noes],
+            "intensity": [n.intensity for n in noes],
+            "c1": [n.c1 for n in noes],
+            "h1": [n.h1 for n in noes],
+            "c2": [n.c2 for n in noes],
+            "h2": [n.h2 for n in noes],
+            "reciprocals": [" ".join(n.reciprocal_str) for n in noes],
+            "clusters": [" ".join(n.cluster_str) for n in noes],
+            "short": ["x" if n.short_range else "" for n in noes]}
 
 
 def set_clusters(noes, signatures):
     """
-    Use the set clusters method of each instance of the Noe class
-    in the given noe list.
+    Set the clusters of each NOE in the given list to be all signatures within
+    the clustering tolerance of itself, unless it has already been manually
+    clustered, in which case use the signatures named in its cluster field
     """
 
-    # Iterate over the set of Noes and set the clusters of the Noe if it has
-    # not already been manually clustered
+    # Sort the signatures by carbon shift so that the signatures within the
+    # carbon tolerance of any NOE form a contiguous window
 
-    for noe in noes:
+    carbon = np.array([s.carbon for s in signatures], dtype=float)
+    hydrogen = np.array([s.hydrogen for s in signatures], dtype=float)
 
-        if not noe.cluster_str:
-            noe.set_clusters(signatures)
+    order = np.argsort(carbon, kind="stable")
+    sorted_carbon = carbon[order]
 
-        else:
-            noe.clusters = {s for s in signatures
-                            if s.label in noe.cluster_str}
+    # Find the window of each NOE that has not been manually clustered
+
+    unclustered = [noe for noe in noes if not noe.cluster_str]
+    c2 = np.array([noe.c2 for noe in unclustered], dtype=float)
+
+    lo = np.searchsorted(sorted_carbon, c2 - 2 * params.CLS_CTOL, side="left")
+    hi = np.searchsorted(sorted_carbon, c2 + 2 * params.CLS_CTOL, side="right")
+
+    # Keep the signatures in each window which are within both tolerances,
+    # in the order they were given
+
+    for noe, start, stop in zip(unclustered, lo, hi):
+
+        window = order[start:stop]
+        keep = ((np.abs(carbon[window] - noe.c2) < params.CLS_CTOL)
+                & (np.abs(hydrogen[window] - noe.h2) < params.CLS_HTOL))
+
+        noe.clusters = [signatures[k] for k in np.sort(window[keep])]
+
+    # Look up the signatures named by the NOEs that have been manually
+    # clustered
+
+    by_label = {s.label: s for s in signatures}
+
+    for noe in noes:
+        if noe.cluster_str:
+            noe.clusters = {by_label[l] for l in noe.cluster_str
+                            if l in by_label}
 
 
 def set_reciprocals(noes):
@@ -190,19 +258,107 @@ def set_reciprocals(noes):
     reciprocals by force
     """
 
-    pairs = itertools.combinations(noes, 2)
-    pairs = [(i, j) for i, j in pairs
-             if i.label in j.reciprocal_str
-             or j.label in i.reciprocal_str]
+    # Find the pairs of known reciprocals by looking up the labels named in
+    # the reciprocals field of each NOE
+
+    by_label = {n.label: idx for idx, n in enumerate(noes)}
+    pairs = set()
+
+    for idx, n in enumerate(noes):
+        for label in n.reciprocal_str:
+
+            other = by_label.get(label)
+            if other is not None and other != idx:
+                pairs.add((min(idx, other), max(idx, other)))
 
     # Iterate over all pairs of known reciprocal and set them as such in the
     # reciprocal field
 
-    for i, j in pairs:
+    for a, b in sorted(pairs):
+
+        i, j = noes[a], noes[b]
+
         i.reciprocals.append(j)
         j.reciprocals.append(i)
 
 
+def coord_arrays(noes):
+    """
+    Return arrays of the c1, c2, h1, and h2 coordinates of the given NOEs, in
+    order, with missing coordinates as NaN
+    """
+
+    def column(values):
+        return np.array([np.nan if v is None else v for v in values],
+                        dtype=float)
+
+    return (column(n.c1 for n in noes), column(n.c2 for n in noes),
+            column(n.h1 for n in noes), column(n.h2 for n in noes))
+
+
+def symmetric_pairs(noes):
+    """
+    Return the sorted list of index pairs (i, j), i < j, of NOEs in the given
+    list which are symmetric according to Noe.symmetric. Rather than testing
+    every pair, each group of NOEs of the same type and range is sorted on one
+    coordinate so that the candidates of each NOE form a contiguous window,
+    and the windows are checked all at once with NumPy
+    """
+
+    c1, c2, h1, h2 = coord_arrays(noes)
+    pairs = []
+
+    # NOEs can only be symmetric to NOEs of the same type and range
+
+    groups = {}
+    for idx, n in enumerate(noes):
+        groups.setdefault((n.type, n.short_range), []).append(idx)
+
+    for (type, short), group in groups.items():
+
+        group = np.array(group)
+
+        # Pick the pair of coordinates to sort and search on. A symmetric
+        # partner of i has its second coordinate near the first of i
+
+        if type == "HCH":
+            first, second, tol = h1[group], h2[group], params.SYM_HTOL
+        else:
+            first, second, tol = c1[group], c2[group], params.SYM_CTOL
+
+        order = np.argsort(second, kind="stable")
+        lo = np.searchsorted(second[order], first - 2 * tol, side="left")
+        hi = np.searchsorted(second[order], first + 2 * tol, side="right")
+
+        # Expand the windows into flat arrays of candidate pairs
+
+        counts = hi - lo
+        rows = np.repeat(np.arange(len(group)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts)
+                                                      - counts, counts)
+        i = group[rows]
+        j = group[order[lo[rows] + offsets]]
+
+        # Keep each pair once, then apply the exact symmetry test
+
+        keep = i < j
+        i, j = i[keep], j[keep]
+
+        if type in {"CCH", "4D"}:
+            keep = ((np.abs(c1[i] - c2[j]) < params.SYM_CTOL)
+                    & (np.abs(c2[i] - c1[j]) < params.SYM_CTOL))
+            i, j = i[keep], j[keep]
+
+        if type in {"HCH", "4D"}:
+            keep = ((np.abs(h1[i] - h2[j]) < params.SYM_HTOL)
+                    & (np.abs(h2[i] - h1[j]) < params.SYM_HTOL))
+            i, j = i[keep], j[keep]
+
+        pairs.extend(zip(i.tolist(), j.tolist()))
+
+    return sorted(pairs)
+
+
 def parse_noe_file(filename):
     """
     Given the name of an NOE CSV file, create a least of NOE objects
@@ -210,20 +366,52 @@ def parse_noe_file(filename):
     """
 
     noes = []
-    csv = pandas.read_csv(filename)
     no_diagonals = 0
 
-    for idx, row in csv.iterrows():
+    # NOE tables written by the conversion scripts may also be parquet or
+    # feather files
+
+    if filename.endswith(".parquet"):
+        csv = pandas.read_parquet(filename)
+    elif filename.endswith(".feather"):
+        csv = pandas.read_feather(filename)
+    else:
+        csv = pandas.read_csv(filename)
+
+    # Pull out each column as an array, using the defaults of the Noe class
+    # for missing optional fields and marking rows without a required field
+    # as invalid
+
+    valid = csv.reindex(columns=["c2", "h2"]).notna().all(axis=1).to_numpy()
+
+    def column(name, default):
+        if name not in csv:
+            return [default] * len(csv)
+        values = csv[name].astype(object)
+        return values.where(csv[name].notna(), default).to_numpy()
+
+    columns = [column("label", ""), column("c1", None), column("c2", None),
+               column("h1", None), column("h2", None),
+               column("intensity", 0.), column("cluster", ""),
+               column("reciprocals", ""), column("short", False)]
+
+    for idx, fields in enumerate(zip(*columns)):
+
+        if valid[idx]:
+            try:
+                noes.append(Noe.from_fields(*fields))
+                continue
 
-        try:
-            noes.append(Noe(row))
+            except Warning:
+                no_diagonals += 1
+                continue
 
-        except Warning:
-            no_diagonals += 1
+            # Optional fields of the wrong type cannot be split
+            except (TypeError, AttributeError):
+                pass
 
-        except:
-            print(f"Invalid NOE definition on line {idx + 1}"
-                  f" of {filename}")
+        print(f"Invalid NOE definition on line {idx + 1}"
+              f" of {filename}")
 
     # Return the list of Noe objects that we have aggregated
     print(f"Read {len(noes)} Noes from {filename} (excluding {no_diagonals} "
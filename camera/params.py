@@ -28,3 +28,12 @@ MAX_COMP_SIZE = 3
 
 FORCE_ASG = False
 FORCE_SV = False
+
+# Number of clauses above which the subprocess solver is handed the formula as
+# a file in shared memory rather than through a pipe
+
+SOLVE_FILE_CLAUSES = 200000
+
+# Number of seconds after which the solver gives up on a formula
+
+SOLVE_TIMEOUT = 15
@@ -6,18 +6,25 @@ formulae for methyl assignment.
 """
 
 import os
-import re
 import uuid
+import array
+import collections
 import tqdm
 import random
 import itertools
 import subprocess
+import numpy as np
 import networkx as nx
 from . import params
+from . import structures
 
+# The in-process bindings to cryptominisat are optional; without them every
+# solve runs the cryptominisat5 binary as a subprocess
 
-# Regular expression for getting assignments from cryptominisat
-SOL_EXPR = re.compile(r"(-?[1-9][0-9]*)")
+try:
+    import pycryptosat
+except ImportError:
+    pycryptosat = None
 
 
 class Formula:
@@ -44,10 +51,29 @@ class Formula:
         self.base_clauses = []
         self.aux_clauses = []
 
-        # Create variable meaning table
+        # Base clauses are only ever appended, so keep their DIMACS text as
+        # it is built along with how many of them it covers
+
+        self.base_body = bytearray()
+        self.nserialized = 0
+
+        # The persistent in-process solver, when one is available, along with
+        # how many of the base clauses have been loaded into it
+
+        self.solver = None
+        self.nloaded = 0
+
+        # The literal assumed by the in-process solver for each auxiliary
+        # clause, and the selector variables standing in for the auxiliary
+        # clauses that are not unit clauses
+
+        self.aux_assumptions = []
+        self.selectors = []
+
+        # Create variable meaning columns
         #
-        # Variable meaning is a table which maps boolean varibles to their
-        # semantics. The semantics of a variable are reprsented a 3-tuple.
+        # The meaning of a boolean variable is reprsented a 3-tuple, stored
+        # here as three columns indexed by the variable (index 0 is unused).
         # The first element of the tuple says whether the variable is an
         # assignment, clustering, activation, or commander variable. If the
         # variable is an assignment variable, the second element is the
@@ -57,15 +83,18 @@ class Formula:
         # activation variable, then the 2nd a 3rd elements are the relevant
         # NOEs (in arbitrary order).
 
-        self.variable_meaning = {}
+        self.variable_type = array.array("b", [0])
+        self.variable_alpha = [None]
+        self.variable_beta = [None]
 
     def add_clause(self, lits):
         """
-        Add dysjunction of given literals to the formula
+        Add dysjunction of given literals to the formula. The literals are
+        stored as a packed array of C ints rather than a list of Python ints
         """
 
         self.nclauses += 1
-        self.base_clauses.append(lits)
+        self.base_clauses.append(array.array("i", lits))
 
     def add_aux_clause(self, lits):
         """
@@ -73,7 +102,7 @@ class Formula:
         """
 
         self.nclauses += 1
-        self.aux_clauses.append(lits)
+        self.aux_clauses.append(array.array("i", lits))
 
     def flush(self):
         """
@@ -83,15 +112,36 @@ class Formula:
         self.nclauses = self.nclauses - len(self.aux_clauses)
         self.aux_clauses = []
 
-    def next_variable(self):
+        # Retire the selectors of the in-process solver so that the clauses
+        # they guard no longer constrain it
+
+        for selector in self.selectors:
+            self.solver.add_clause([-selector])
+
+        self.aux_assumptions = []
+        self.selectors = []
+
+    def next_variable(self, vtype=0, alpha=None, beta=None):
         """
         Get the next available variable and increment the number of variables
-        that have been assigned
+        that have been assigned, recording the meaning of the new variable
         """
 
+        self.variable_type.append(vtype)
+        self.variable_alpha.append(alpha)
+        self.variable_beta.append(beta)
+
         self.nvars += 1
         return self.nvars
 
+    def meaning(self, var):
+        """
+        Get the meaning of a variable as a (type, alpha, beta) tuple
+        """
+
+        return (self.variable_type[var], self.variable_alpha[var],
+                self.variable_beta[var])
+
     def enumerate(self):
         """
         Enumerate the support sets for the signatures
@@ -105,10 +155,13 @@ class Formula:
 
         asgvar = self.assignment_variables
 
-        # Initialize set of all vertices as those which have not had their
-        # support sets fully enumerated
+        # Initialize list of all vertices as those which have not had their
+        # support sets fully enumerated. The list is shuffled once and then
+        # walked in order, so the solver sees related queries back to back
 
-        unfinished = set(asgvar.keys())
+        unfinished = list(asgvar.keys())
+        random.shuffle(unfinished)
+        step = 0
         pbar = tqdm.tqdm(total=len(unfinished))
 
         # Initialize support sets to be empty
@@ -130,19 +183,24 @@ class Formula:
                 # Return the computed support sets
                 return support
 
-            # Select an unfinished vertex at random
+            # Select the next unfinished vertex in the shuffled order
+
+            step %= len(unfinished)
+            focus = unfinished[step]
 
-            focus = random.sample(unfinished, 1)[0]
+            # If every methyl in the domain of this vertex has been seen then
+            # there is no unseen assignment left, so skip the solver
 
-            # Force this vertex to take an as yet unseen assignment
+            if len(support[focus]) == len(asgvar[focus]):
+                result = []
 
-            for seen in support[focus]:
-                self.add_aux_clause([-asgvar[focus][seen]])
+            else:
 
-            # Run the solver
+                # Run the solver, assuming this vertex takes an as yet unseen
+                # assignment
 
-            result = self.solve()
-            self.flush()  # Delete aux clauses
+                result = self.solve([-asgvar[focus][seen]
+                                     for seen in support[focus]])
 
             if result:
 
@@ -152,12 +210,17 @@ class Formula:
                     if vtype == Formula.ASG_VAR:
                         support[alpha].add(beta)
 
+                # Move on to the next vertex
+
+                step += 1
+
             else:
 
-                # We are done with this vertex, so remove it from unfinished
-                # and lock it to its known assignments
+                # We are done with this vertex, so remove it from unfinished,
+                # which leaves the next vertex at the same step, and lock it
+                # to its known assignments
                 pbar.update()
-                unfinished.remove(focus)
+                del unfinished[step]
                 self.add_clause([asgvar[focus][s] for s in support[focus]])
 
     def inject_vertices(self, signatures, structure):
@@ -170,8 +233,14 @@ class Formula:
         assignment an injective function
         """
 
-        # Get the set of methyls from the structure
+        # Get the set of methyls from the structure, and start an index of
+        # the signatures that can be assigned to each methyl
         methyls = list(structure.nodes())
+        candidates = {m: [] for m in methyls}
+
+        # Signatures share a handful of color sets, so keep the methyls
+        # compatible with each color set once it has been seen
+        compatible = {}
 
         # Iterate over the signatures
         for signature in signatures:
@@ -190,16 +259,19 @@ class Formula:
 
             else:
                 # Otherwise, just filter down by color compatiblity
-                domain = filter(lambda m: m.color in signature.color, methyls)
+                colors = frozenset(signature.color)
+                if colors not in compatible:
+                    compatible[colors] = [m for m in methyls
+                                          if m.color in colors]
+                domain = compatible[colors]
 
             # Create a variable for each methyl in the domain
             for methyl in domain:
 
                 # Get a variable for this methyl assignment
-                var = self.next_variable()
+                var = self.next_variable(Formula.ASG_VAR, signature, methyl)
                 table[methyl] = var
-                self.variable_meaning[var] = (Formula.ASG_VAR, signature,
-                                              methyl)
+                candidates.setdefault(methyl, []).append(signature)
 
             # Force exactly one of the assignment variables for this signature
             # to be True
@@ -211,8 +283,7 @@ class Formula:
         for m in methyls:
 
             # Get signatures that can be assigned to this methyl
-            domain = [s for s in signatures if m in
-                      self.assignment_variables[s]]
+            domain = candidates[m]
 
             # Force no more than one of the assignment variables for
             # assignments to m to be true in any satisfying assignment
@@ -221,106 +292,286 @@ class Formula:
 
     def at_most_one(self, lits):
         """
-        Use the commander encoding to force that at most one of the given
+        Use the binary encoding to force that at most one of the given
         literals is True in any satisfying assignment to the formula
         """
 
+        # With fewer than two literals there is nothing to constrain
+        if len(lits) < 2:
+            return
+
         # If there are 3 or fewer literals in the given list, simply
         # use the naive implmentation of at_most_one
         if len(lits) < 4:
             self.naive_at_most_one(lits)
             return
 
-        # Initialize an empty list of commander variables
-        commanders = []
+        # Create one bit variable for each binary digit needed to number the
+        # literals, and one more which is True exactly when some literal is
+        # True
+        any_true = self.next_variable(Formula.CMD_VAR)
+        bits = [self.next_variable(Formula.CMD_VAR)
+                for _ in range((len(lits) - 1).bit_length())]
+
+        self.add_clause([-any_true] + lits)
+
+        # Make each literal imply that the bits spell out its index. Two true
+        # literals would need the bits to spell out two different indices, so
+        # at most one of them can be true
+        for idx, lit in enumerate(lits):
+            self.add_clause([-lit, any_true])
+            for k, bit in enumerate(bits):
+                self.add_clause([-lit, bit if (idx >> k) & 1 else -bit])
+
+        # When no literal is true clear the bits, so that every assignment to
+        # the literals has exactly one model and samples are not weighted by
+        # the free bits
+        for bit in bits:
+            self.add_clause([any_true, -bit])
 
-        # Partition the given literals into small sets. Create a commander
-        # variable for each set and force the commander to be True IFF one
-        # variable in its set is true
-        idx = 0
-        while idx < len(lits):
+    def naive_at_most_one(self, lits):
+        """
+        Use the naive clause construction to force no more than one of the
+        given literals to be True in any satisfying assignment
+        """
 
-            # Get partition of variables and create commander for it
-            group = lits[idx:idx+3]
-            cmdr = self.next_variable()
-            commanders.append(cmdr)
+        # at_most_one only hands over two or three literals, so write those
+        # cases out and keep the pairwise loop for any other caller
 
-            # Set the meaning of the commander variable
-            self.variable_meaning[cmdr] = (Formula.CMD_VAR, None, None)
+        if len(lits) == 2:
+            self.add_clause([-lits[0], -lits[1]])
 
-            # Make the commander imply that one of the literals is true
-            self.add_clause([-cmdr] + group)
+        elif len(lits) == 3:
+            a, b, c = lits
+            self.add_clause([-a, -b])
+            self.add_clause([-a, -c])
+            self.add_clause([-b, -c])
 
-            # Make the commander imply that every literal in its set if false
-            for l in group:
-                self.add_clause([cmdr, -l])
+        else:
+            for l1, l2 in itertools.combinations(lits, 2):
+                self.add_clause([-l1, -l2])
 
-            # Make it so that at most one of the literals in the group is true
-            self.at_most_one(group)
+    def to_chunks(self):
+        """
+        Return the DIMACS format encoding of this formula as a list of bytes
+        objects to be written out in order. Only the base clauses added since
+        the last call and the auxiliary clauses are converted to text
+        """
 
-            idx += 3
+        # Extend the text of the base clauses with any new base clauses
+        new_clauses = self.base_clauses[self.nserialized:]
+        self.base_body += clauses_to_bytes(new_clauses)
+        self.nserialized = len(self.base_clauses)
 
-        # Make it so that at most one of the commanders we created
-        # is true in any satisfying assignment
-        self.at_most_one(commanders)
+        # Get the header of the formula and the body separately
+        header = f"p cnf {self.nvars} {self.nclauses}\n".encode()
+        aux_body = clauses_to_bytes(self.aux_clauses)
 
-    def naive_at_most_one(self, lits):
+        return [header, self.base_body, aux_body]
+
+    def to_bytes(self):
         """
-        Use the naive clause construction to force no more than one of the
-        given literals to be True in any satisfying assignment
+        Return a DIMACS format encoding of this formula as bytes
         """
 
-        for l1, l2 in itertools.combinations(lits, 2):
-            self.add_clause([-l1, -l2])
+        return b"".join(self.to_chunks())
 
     def to_string(self):
         """
         Return a DIMACS format string of this formula
         """
 
-        # Get the header of the formula and the body separately
-        header = f"p cnf {self.nvars} {self.nclauses}"
-        body = "\n".join(map(clause_to_string,
-                             self.base_clauses + self.aux_clauses))
-
-        # Return the header and the body combined
-        return header + "\n" + body
+        return self.to_bytes().decode()
 
     def to_file(self, outfile):
         """
         Write formula out to output file
         """
 
-        with open(outfile, "w") as outf:
-            outf.write(self.to_string())
+        with open(outfile, "wb") as outf:
+            outf.writelines(self.to_chunks())
+
+    def solve(self, assumptions=()):
+        """
+        Run the solver and get back a solution in which the given literals
+        are all True. When pycryptosat is installed a single solver is kept
+        alive across calls: new base clauses are added to it incrementally and
+        the assumptions and auxiliary clauses are passed as assumptions, so
+        nothing learned about the base formula is thrown away between solves
+        """
+
+        if pycryptosat is None:
+            return self.solve_subprocess(assumptions)
 
-    def solve(self):
+        # Create the solver on first use, with the same time limit for each
+        # solve as the subprocess solver, and load whatever base clauses it
+        # has not yet seen
+
+        if self.solver is None:
+            self.solver = pycryptosat.Solver(time_limit=params.SOLVE_TIMEOUT)
+
+        self.solver.add_clauses(self.base_clauses[self.nloaded:])
+        self.nloaded = len(self.base_clauses)
+
+        # The solver only knows the variables it has seen in a clause, so
+        # make sure it knows them all before any are assumed
+
+        if self.solver.nb_vars() < self.nvars:
+            self.solver.add_clause([self.nvars, -self.nvars])
+
+        # Unit auxiliary clauses are assumed directly. Any other auxiliary
+        # clause is loaded with a fresh selector variable that turns it on
+        # when assumed and off once flush adds its negation
+
+        for clause in self.aux_clauses[len(self.aux_assumptions):]:
+            if len(clause) == 1:
+                self.aux_assumptions.append(clause[0])
+            else:
+                selector = self.next_variable()
+                self.solver.add_clause(clause.tolist() + [-selector])
+                self.selectors.append(selector)
+                self.aux_assumptions.append(selector)
+
+        # Solve under the given literals and the auxiliary clauses as
+        # assumptions
+
+        satisfiable, solution = self.solver.solve(self.aux_assumptions +
+                                                  list(assumptions))
+
+        # Give up when the time limit is hit, as the subprocess solver does
+
+        if satisfiable is None:
+            raise subprocess.TimeoutExpired("pycryptosat",
+                                            params.SOLVE_TIMEOUT)
+
+        if not satisfiable:
+            return []
+
+        return self.interpret(v for v in range(1, len(solution))
+                              if solution[v])
+
+    def solve_subprocess(self, assumptions=()):
         """
-        Run the solver and get back a solution
+        Run the cryptominisat5 binary on the formula and get back a solution
+        in which the given literals are all True
         """
 
-        # Get string representation of self
-        formula_str = self.to_string()
+        # The binary has no assumptions, so give it each of the literals as
+        # an auxiliary unit clause for the duration of this call
+
+        if assumptions:
+            nassumed = len(assumptions)
+            for lit in assumptions:
+                self.add_aux_clause([lit])
+
+            try:
+                return self.solve_subprocess()
+            finally:
+                del self.aux_clauses[-nassumed:]
+                self.nclauses -= nassumed
+
+        # Large formulas are written to a file in shared memory, when there
+        # is one, and the solver reads that file instead of a pipe
+
+        if self.nclauses > params.SOLVE_FILE_CLAUSES:
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp"
+            filename = os.path.join(directory, str(uuid.uuid4()) + ".cnf")
+            self.to_file(filename)
+
+            try:
+                output = subprocess.run(["cryptominisat5", "--verb=0",
+                                         filename],
+                                        stdout=subprocess.PIPE,
+                                        timeout=params.SOLVE_TIMEOUT).stdout
+            finally:
+                os.remove(filename)
+
+            return self.interpret(get_assignments(output))
 
-        # Run the solver as a subprocess
-        process = subprocess.run(["cryptominisat5", "--verb=0"],
-                                 input=bytes(formula_str, "utf-8"),
-                                 stdout=subprocess.PIPE,
-                                 timeout=15)
+        # Otherwise run the solver as a subprocess, writing the DIMACS
+        # encoding of self straight into its input without joining it into
+        # one buffer first
+        process = subprocess.Popen(["cryptominisat5", "--verb=0"],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE)
 
-        assignments = get_assignments(process.stdout)
+        try:
+            for chunk in self.to_chunks():
+                process.stdin.write(chunk)
 
-        return [self.variable_meaning[a] for a in assignments if a > 0]
+            output, _ = process.communicate(timeout=params.SOLVE_TIMEOUT)
+
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+
+        return self.interpret(get_assignments(output))
+
+    def interpret(self, variables):
+        """
+        Get the meanings of the given true variables. Commander variables and
+        variables without a meaning are left out, as no caller looks at them
+        """
+
+        vtype = self.variable_type
+        return [self.meaning(v) for v in variables
+                if vtype[v] and vtype[v] != Formula.CMD_VAR]
 
 
 def get_assignments(output):
     """
-    Parse a complete variable assignment from the output of cryptominisat
+    Parse the variables set to True from the output of cryptominisat, given
+    as bytes
     """
 
-    # Use REGEX to find all integer strings in the output string and convert
-    # to ints and then return.
-    return set(map(int, SOL_EXPR.findall(str(output))))
+    # Join the payloads of the solution lines, which start with "v " and end
+    # with a 0, and let NumPy tokenize and convert them in one go
+    payload = b" ".join(line[2:] for line in output.splitlines()
+                        if line.startswith(b"v "))
+    literals = np.fromstring(payload, sep=" ", dtype=np.int64)
+
+    return literals[literals > 0].tolist()
+
+
+def bipartite_components(network):
+    """
+    Yield the connected components of a bipartite network as a tuple of the
+    two sides of the component and the list of its edges, found with a
+    breadth first search over the adjacency of the network
+    """
+
+    adj = network.adj
+    side = {}
+
+    for source in adj:
+
+        # Skip nodes that were reached from an earlier source
+
+        if source in side:
+            continue
+
+        # Two color the component of the source node. Every edge has exactly
+        # one end on the first side, so collect edges from that side only
+
+        side[source] = 0
+        parts = ([source], [])
+        edges = []
+        queue = collections.deque([source])
+
+        while queue:
+            node = queue.popleft()
+            for other in adj[node]:
+                if other not in side:
+                    side[other] = 1 - side[node]
+                    parts[side[other]].append(other)
+                    queue.append(other)
+                elif side[other] == side[node]:
+                    raise nx.NetworkXError("Graph is not bipartite.")
+                if side[node] == 0:
+                    edges.append((node, other))
+
+        yield parts[0], parts[1], edges
 
 
 def clause_to_string(clause):
@@ -331,6 +582,15 @@ def clause_to_string(clause):
     return " ".join(map(str, clause)) + " 0"
 
 
+def clauses_to_bytes(clauses):
+    """
+    Return the DIMACS format encoding of the given clauses as bytes, one
+    clause per line
+    """
+
+    return "".join(clause_to_string(c) + "\n" for c in clauses).encode()
+
+
 class ClusteringCSP(Formula):
     """
     This class extends formula to implement the clustering CSP, which takes
@@ -339,19 +599,30 @@ class ClusteringCSP(Formula):
     structure using the network to form ambiguous constraints.
     """
 
-    def __init__(self, signatures, network, structure):
+    def __init__(self, signatures, network, structure, candidates=None):
         """
         Construct a new clustering CSP given signatures, an NOE network, and
         a structure. First, call the Formula constructor to get define the
-        basic methods which make use of the SAT solver.
+        basic methods which make use of the SAT solver. The edges of the
+        optional candidates graph, which shares no NOEs with the active part
+        of the network, get activation variables that nothing forces either
+        way, so that solving under assumptions can activate any of them
         """
 
         # First, call the Formula constructor
         Formula.__init__(self)
 
-        # Replace the network with the active components of the network
+        # Replace the network with the active components of the network, and
+        # get the graph of every edge which may be active
         network = network.active_graph()
 
+        if candidates is None:
+            candidates = nx.Graph()
+            edges = network
+
+        else:
+            edges = nx.compose(network, candidates)
+
         # Create variable tables
         #
         # self.assignment_variables is a dictionary where the keys are
@@ -371,16 +642,22 @@ class ClusteringCSP(Formula):
         # reciprocal NOEs.
 
         self.assignment_variables = {s: {} for s in signatures}
-        self.clustering_variables = {n: {} for n in network.nodes()}
-        self.activation_variables = {n: {} for n in network.nodes()}
+        self.clustering_variables = {n: {} for n in edges.nodes()}
+        self.activation_variables = {n: {} for n in edges.nodes()}
+
+        # Many NOEs are clustered to the same pairs of signatures, so the
+        # distance clauses for each pair are built once and kept here
+
+        self.distance_tails = {}
 
         # Construct the formula by creating variables and clauses
 
         self.inject_vertices(signatures, structure)
-        self.create_clustering_variables(network, signatures)
+        self.create_clustering_variables(edges, signatures)
         self.create_activation_variables(network)
+        self.create_candidate_variables(candidates)
         self.respect_matching(network)
-        self.distance_constraints(signatures, network, structure)
+        self.distance_constraints(signatures, edges, structure)
         self.geminal_constraints(signatures, structure)
 
     def enumerate_clusterings(self):
@@ -452,8 +729,7 @@ class ClusteringCSP(Formula):
                 # Create a variable that captures the clustering of this noe
                 # to this cluster
 
-                var = self.next_variable()
-                self.variable_meaning[var] = (Formula.CST_VAR, noe, cluster)
+                var = self.next_variable(Formula.CST_VAR, noe, cluster)
                 table[cluster] = var
 
             # Make it so that exactly one of the clustering variables is true
@@ -481,8 +757,19 @@ class ClusteringCSP(Formula):
 
             # Create a variable representing the activity of this edge
 
-            var = self.next_variable()
-            self.variable_meaning[var] = (Formula.ACT_VAR, i, j)
+            var = self.next_variable(Formula.ACT_VAR, i, j)
+            self.activation_variables[i][j] = var
+            self.activation_variables[j][i] = var
+
+    def create_candidate_variables(self, candidates):
+        """
+        Create variables corresponding to the activation of each edge of the
+        candidates graph, which are left free for assumptions to decide
+        """
+
+        for i, j in candidates.edges():
+
+            var = self.next_variable(Formula.ACT_VAR, i, j)
             self.activation_variables[i][j] = var
             self.activation_variables[j][i] = var
 
@@ -493,19 +780,16 @@ class ClusteringCSP(Formula):
         formula.
         """
 
-        # Iterate over the connected components of the network
+        # Iterate over the connected components of the network, each already
+        # split into its bipartite sets
 
-        for component in nx.connected_component_subgraphs(network):
+        for left, right, edges in bipartite_components(network):
 
             # If the component has only two nodes it is respected by default
 
-            if component.number_of_nodes() < 3:
+            if len(left) + len(right) < 3:
                 continue
 
-            # Partition the nodes into biparite sets
-
-            left, right = nx.bipartite.sets(component)
-
             # As a convention, the left side is the one with fewer vertices.
             # Swap left and right if right has fewer vertices.
 
@@ -522,8 +806,9 @@ class ClusteringCSP(Formula):
             # vertices in the smaller biparite set of that component. Here we
             # run a check to verify that this is the case.
 
-            mcm_size = len(nx.max_weight_matching(component,
-                                                  maxcardinality=True))
+            matching = nx.bipartite.hopcroft_karp_matching(nx.Graph(edges),
+                                                           top_nodes=left)
+            mcm_size = len(matching) // 2
 
             assert mcm_size == len(left)
 
@@ -556,6 +841,24 @@ class ClusteringCSP(Formula):
 
             short = i.short_range
 
+            # The literal for this edge being active, needed unless the edge
+            # is always active and so has no variable, and the literal for
+            # each clustering of i and of j, needed unless that clustering is
+            # unique, are the same for every pair of clusterings, so get them
+            # once per edge
+
+            if j in self.activation_variables[i]:
+                edge_lits = [-self.activation_variables[i][j]]
+            else:
+                edge_lits = []
+
+            i_table = self.clustering_variables[i]
+            j_table = self.clustering_variables[j]
+            i_lits = {c: [-i_table[c]] if len(i.clusters) > 1 else []
+                      for c in i.clusters}
+            j_lits = {c: [-j_table[c]] if len(j.clusters) > 1 else []
+                      for c in j.clusters}
+
             # Iterate over clusterings of this edge
 
             for i_c, j_c in itertools.product(i.clusters, j.clusters):
@@ -572,16 +875,7 @@ class ClusteringCSP(Formula):
                 # clusterings are unique and the edge is always active, then
                 # the base clause is empty.
 
-                base_clause = []
-
-                if network.degree(i) > 1 or network.degree(j) > 1:
-                    base_clause.append(-self.activation_variables[i][j])
-
-                if len(i.clusters) > 1:
-                    base_clause.append(-self.clustering_variables[i][i_c])
-
-                if len(j.clusters) > 1:
-                    base_clause.append(-self.clustering_variables[j][j_c])
+                base_clause = edge_lits + i_lits[i_c] + j_lits[j_c]
 
                 # Call a helper that forces an edge between i_c and j_c to
                 # be respected, conditional on the base clause being
@@ -598,52 +892,53 @@ class ClusteringCSP(Formula):
         conditional on the given base clause being unsatisfiable
         """
 
-        # Get the alpha and beta assignment variable tables locally
-        alpha_table = self.assignment_variables[alpha]
-        beta_table = self.assignment_variables[beta]
-
-        # Iterate over the domain of alpha
+        # The clauses for this pair of signatures only differ in their base
+        # clause, so build what follows it once per pair and edge type
+        if (alpha, beta, short) not in self.distance_tails:
+            self.distance_tails[alpha, beta, short] = self.distance_tails_of(
+                alpha, beta, structure, short)
 
-        for alpha_methyl in alpha_table:
+        # Add each clause to the formula, extending the base clause
+        for tail in self.distance_tails[alpha, beta, short]:
+            self.add_clause(base_clause + tail)
 
-            # Create a copy of the base_clause
-            clause = base_clause.copy()
-
-            # Append negation of alpha -> alpha_methyl variable to clause
-            clause.append(-alpha_table[alpha_methyl])
-
-            # Localize the neighborhood of alpha_methyl in the structure
-            alpha_neighborhood = structure[alpha_methyl]
-
-            # Iterate over the domain of beta
-            for beta_methyl in beta_table:
-
-                # If alpha_methyl and beta_methyl are the same, then this
-                # can't be an edge of G and can't be used to satisfy the
-                # edge between alpha and beta
+    def distance_tails_of(self, alpha, beta, structure, short):
+        """
+        Get, for each methyl alpha may be assigned to, the negation of that
+        assignment variable followed by the beta assignment variables which
+        satisfy an edge between alpha and beta (signatures)
+        """
 
-                if alpha_methyl == beta_methyl:
-                    continue
+        # Get the alpha and beta assignment variable tables locally
+        alpha_table = self.assignment_variables[alpha]
+        beta_table = self.assignment_variables[beta]
 
-                # If alpha_methyl and beta_methyl are close in the structure,
-                # then allow alpha -> alpha_methyl and beta -> beta_methyl
-                # to satisfy the clause
+        # Get the matrix of which pairs of methyls are close enough to satisfy
+        # this edge
+        if short:
+            index, near = structures.close_matrix(structure,
+                                                  params.SHORT_RADIUS,
+                                                  params.SHORT_RADIUS)
+        else:
+            index, near = structures.close_matrix(structure, params.RADIUS,
+                                                  params.ADDED_RADIUS)
 
-                distance = alpha_neighborhood[beta_methyl]["distances"][0]
+        # Restrict the matrix to the domains of alpha and beta, so that each
+        # row picks out the beta assignment variables which can satisfy the
+        # edge for one alpha assignment. A methyl is never close to itself, so
+        # this can't assign both to the same methyl
 
-                if short:
-                    if distance < params.SHORT_RADIUS:
-                        clause.append(beta_table[beta_methyl])
+        alpha_idx = np.array([index[m] for m in alpha_table], dtype=int)
+        beta_idx = np.array([index[m] for m in beta_table], dtype=int)
+        beta_vars = np.array(list(beta_table.values()), dtype=int)
 
-                elif alpha_methyl.added or beta_methyl.added:
-                    if distance < params.ADDED_RADIUS:
-                        clause.append(beta_table[beta_methyl])
+        rows = near[np.ix_(alpha_idx, beta_idx)]
 
-                elif distance < params.RADIUS:
-                    clause.append(beta_table[beta_methyl])
+        # Pair the negation of each alpha -> alpha_methyl variable with the
+        # beta variables that satisfy it
 
-            # Add this clause to the formula
-            self.add_clause(clause)
+        return [[-alpha_table[alpha_methyl]] + beta_vars[row].tolist()
+                for alpha_methyl, row in zip(alpha_table, rows)]
 
     def geminal_constraints(self, signatures, structure):
         """
@@ -651,9 +946,13 @@ class ClusteringCSP(Formula):
         in the structure by every satisfying assignment to the formula
         """
 
-        # Identify all geminal pairs of signatures
+        # Identify all geminal pairs of signatures in the order the signatures
+        # are given, and the geminal partners of each methyl. Each pair shows
+        # up once from either side; both directions are kept, as the clauses
+        # from j to i let propagation rule out j's unpaired methyls directly
 
-        geminals = {(i, i.geminal) for i in signatures if i.geminal}
+        geminals = [(i, i.geminal) for i in signatures if i.geminal]
+        partners = structures.geminal_methyls(structure)
 
         # Iterate over geminals pairs of signatures
 
@@ -669,8 +968,8 @@ class ClusteringCSP(Formula):
                 # can only be satisfied if j is assigned to the geminal pair
                 # of i_methyl
 
-                for j_methyl in self.assignment_variables[j]:
-                    if i_methyl.geminal(j_methyl):
+                for j_methyl in partners.get(i_methyl, ()):
+                    if j_methyl in self.assignment_variables[j]:
                         clause.append(self.assignment_variables[j][j_methyl])
 
                 # Add this clause to the formula
@@ -776,10 +1075,11 @@ class IsomorphismCSP(Formula):
 
         # Run the sampler
 
-        subprocess.run(f"spur -s {num_samples} -cnf {basename + '.cnf'} "
-                       f"-w {basename + '.txt'} "
-                       f"-out {basename + '.samples'}",
-                       shell=True, stdout=open(os.devnull, "w"))
+        subprocess.run(["spur", "-s", str(num_samples),
+                        "-cnf", basename + ".cnf",
+                        "-w", basename + ".txt",
+                        "-out", basename + ".samples"],
+                       stdout=subprocess.DEVNULL)
 
         # Read in the samples
 
@@ -805,18 +1105,26 @@ class IsomorphismCSP(Formula):
         Parse assignments string output by SPUR sampler
         """
 
-        # Iterate over the samples we collected and parse the assignments.
-        # Each assignment is a mapping from signatures to methyls
+        # Each sample is a string with one character, 0 or 1, per variable.
+        # Only the assignment variables matter, so find their positions once
+
+        positions = [(var - 1, self.variable_alpha[var],
+                      self.variable_beta[var])
+                     for var in range(1, self.nvars + 1)
+                     if self.variable_type[var] == Formula.ASG_VAR]
+        indices = np.array([idx for idx, _, _ in positions], dtype=np.int64)
+
+        # Iterate over the samples we collected and parse the assignments,
+        # reading each sample's characters as a byte array. Each assignment is
+        # a mapping from signatures to methyls
 
         assignments = []
         for sample in samples:
-            assignment = {}
-            for idx, val in enumerate(sample):
-                if int(val):
-                    vtype, alpha, beta = self.variable_meaning[idx + 1]
-                    if vtype == Formula.ASG_VAR:
-                        assignment[alpha] = beta
-            assignments.append(assignment)
+            bits = np.frombuffer(sample.encode(), dtype=np.uint8) == ord("1")
+            hits = np.flatnonzero(indices < len(bits))
+            hits = hits[bits[indices[hits]]]
+            assignments.append({positions[k][1]: positions[k][2]
+                                for k in hits.tolist()})
 
         # Return the list of assignments
 
@@ -833,6 +1141,17 @@ class IsomorphismCSP(Formula):
 
         asgvar = self.assignment_variables
 
+        # Get the methyls close to each methyl, for short and other edges
+
+        short_close = structures.close_methyls(structure, params.SHORT_RADIUS,
+                                               params.SHORT_RADIUS)
+        close = structures.close_methyls(structure, params.RADIUS,
+                                         params.ADDED_RADIUS)
+
+        # Get the geminal partners of each methyl
+
+        partners = structures.geminal_methyls(structure)
+
         # Iterate over the edges of the graph H
 
         for i, j in graph_h.edges():
@@ -840,6 +1159,13 @@ class IsomorphismCSP(Formula):
             # Check whether these are a geminal
             h_geminal = i.is_geminal(j)
 
+            # Get the methyls close enough to each methyl to satisfy this edge
+
+            if graph_h[i][j]["short"]:
+                near = short_close
+            else:
+                near = close
+
             # Iterate over the domain of the vertex i
 
             for i_met in asgvar[i].keys():
@@ -849,65 +1175,48 @@ class IsomorphismCSP(Formula):
 
                 clause = [-asgvar[i][i_met]]
 
+                # A geminal edge of H can only go to a geminal partner of i_met
+
+                geminal = partners[i_met]
+
                 # Iterate over domain of the vertex j
 
                 for j_met in asgvar[j].keys():
 
-                    # If i_met and j_met are the same methyl, ignore
+                    # If j_met is not close enough to i_met in the structure,
+                    # which includes it being the same methyl, ignore
 
-                    if i_met == j_met:
+                    if j_met not in near[i_met]:
                         continue
 
                     # Compare geminality of the edge of H to this pair in the
                     # structure
 
-                    if h_geminal > i_met.geminal(j_met):
+                    if h_geminal and j_met not in geminal:
                         continue
 
-                    # Get the distance between i_met and j_met over the
-                    # structure
-
-                    distance = structure[i_met][j_met]["distances"][0]
-
-                    # If the distance between i_met and j_met is short enough,
-                    # allow j -> j_met to satisfy this clause
-
-                    within_range = False
-
-                    if graph_h[i][j]["short"]:
-                        if distance < params.SHORT_RADIUS:
-                            within_range = True
+                    # Allow j -> j_met to satisfy this clause
 
-                    elif i_met.added or j_met.added:
-                        if distance < params.ADDED_RADIUS:
-                            within_range = True
+                    clause.append(asgvar[j][j_met])
 
-                    elif distance < params.RADIUS:
-                        within_range = True
-
-                    if within_range:
-
-                        clause.append(asgvar[j][j_met])
-
-                        if not self.edge_vars:
-                            continue
+                    if not self.edge_vars:
+                        continue
 
-                        # Create a variable which represents that (i,j) is
-                        # mapped to i_map, j_map
+                    # Create a variable which represents that (i,j) is
+                    # mapped to i_map, j_map
 
-                        variable = self.next_variable()
-                        self.variable_cost[variable] = distance
-                        self.variable_meaning[variable] = (Formula.EDG_VAR,
-                                                           (i, j),
-                                                           (i_met, j_met))
+                    variable = self.next_variable(Formula.EDG_VAR, (i, j),
+                                                  (i_met, j_met))
+                    distance = structure[i_met][j_met]["distances"][0]
+                    self.variable_cost[variable] = distance
 
-                        # Constrain the variable to be true if and only if the
-                        # vertex assignment variables are true
+                    # Constrain the variable to be true if and only if the
+                    # vertex assignment variables are true
 
-                        self.add_clause([-variable, asgvar[i][i_met]])
-                        self.add_clause([-variable, asgvar[j][j_met]])
-                        self.add_clause([variable, -asgvar[i][i_met],
-                                         -asgvar[j][j_met]])
+                    self.add_clause([-variable, asgvar[i][i_met]])
+                    self.add_clause([-variable, asgvar[j][j_met]])
+                    self.add_clause([variable, -asgvar[i][i_met],
+                                     -asgvar[j][j_met]])
 
                 # Add the clause to the set of base clauses
 
@@ -939,7 +1248,8 @@ def gibbs_reduce(graph_h, structure, exponent, num_samples):
         # Run marginalization.
 
         marginals, samples = formula.marginalize(exponent, num_samples)
-        correlate_assignments(formula, marginals, samples)
+        correlate_assignments(formula, marginals,
+                              sample_table(marginals, samples))
 
         for vertex, distribution in marginals.items():
 
@@ -974,18 +1284,48 @@ def gibbs_reduce(graph_h, structure, exponent, num_samples):
         old_percent_nailed = percent_nailed
 
 
-def correlate_assignments(formula, marginals, samples):
+def sample_table(marginals, samples):
+    """
+    Tabulate the sequence ID each sample assigns to each signature, with one
+    row per sample and one column per signature of the marginals, in order
+    """
+
+    return np.fromiter((sample[sig].seqid for sample in samples
+                        for sig in marginals),
+                       dtype=np.int32,
+                       count=len(samples) * len(marginals)).reshape(
+                           len(samples), len(marginals))
+
+
+def correlate_assignments(formula, marginals, seqids):
     """
     Iterate over all pairs of vertex assignments. If the probability of a pair
     co-occuring deviates significantly from the product of the marginal
     probability of those assignments, then place a hard constraint forcing
     the assignments to be either logically equivalent or mutually exclusive.
+    The samples are given as a table from sample_table
     """
 
     # Localize the formula's assignment variable table.
 
     asgvar = formula.assignment_variables
 
+    # Without samples no pair can be seen to co-occur
+
+    if not len(seqids):
+        return
+
+    # Get the column of the sample table for each signature
+
+    column = {sig: k for k, sig in enumerate(marginals)}
+
+    # Group the domain of each signature by sequence ID
+
+    by_seqid = {sig: collections.defaultdict(list) for sig in marginals}
+    for sig in marginals:
+        for m in asgvar[sig]:
+            by_seqid[sig][m.seqid].append(m)
+
     # Iterate over all pairs of signatures
 
     for sig1, sig2 in itertools.combinations(marginals.keys(), 2):
@@ -1000,49 +1340,51 @@ def correlate_assignments(formula, marginals, samples):
         if len(marginals[sig1]) == 1 or len(marginals[sig2]) == 1:
             continue
 
-        # Iterate over all pairs of assignments between these two.
-
-        for m1_id, m2_id in itertools.product(marginals[sig1].keys(),
-                                              marginals[sig2].keys()):
+        # Count the fraction of samples in which each pair of assignments
+        # co-occur, indexing the sequence IDs of each signature in the order
+        # of its marginals
 
-            # If these are the same methyl, ignore.
+        ids1 = np.array(list(marginals[sig1]))
+        ids2 = np.array(list(marginals[sig2]))
+        order1 = np.argsort(ids1)
+        order2 = np.argsort(ids2)
+        rows = order1[np.searchsorted(ids1[order1], seqids[:, column[sig1]])]
+        cols = order2[np.searchsorted(ids2[order2], seqids[:, column[sig2]])]
 
-            if m1_id == m2_id:
-                continue
+        joint = np.zeros((len(ids1), len(ids2)))
+        np.add.at(joint, (rows, cols), 1. / len(seqids))
 
-            # Get the product of the marginal probability of sig1 -> m1 and
-            # sig2 -> m2.
+        # Compare against the product of the marginal probabilities of each
+        # pair of assignments, and keep only the pairs of distinct methyls
+        # that co-occur far more or far less often than independence predicts
 
-            independent_prob = marginals[sig1][m1_id] * marginals[sig2][m2_id]
+        independent = np.outer(list(marginals[sig1].values()),
+                               list(marginals[sig2].values()))
+        correlated = joint > 10 * independent
+        exclusive = joint * 10 < independent
+        distinct = ids1[:, np.newaxis] != ids2[np.newaxis, :]
 
-            # Count the fraction of samples in which these assignments co-occur
+        # Iterate over the remaining pairs of assignments between these two.
 
-            real_prob = 0
-            for sample in samples:
+        for a, b in zip(*np.nonzero((correlated | exclusive) & distinct)):
 
-                if sample[sig1].seqid == m1_id and sample[sig2].seqid == m2_id:
-                    real_prob += 1/len(samples)
+            m1_id, m2_id = ids1[a].item(), ids2[b].item()
 
-            # Get the methyls with the given sequence IDs.
+            # Get the assignment variables of the methyls with the given
+            # sequence IDs.
 
-            m1s = [m for m in asgvar[sig1].keys() if m.seqid == m1_id]
+            vars1 = [asgvar[sig1][m1] for m1 in by_seqid[sig1][m1_id]]
 
-            m2s = [m for m in asgvar[sig2].keys() if m.seqid == m2_id]
+            vars2 = [asgvar[sig2][m2] for m2 in by_seqid[sig2][m2_id]]
 
-            if real_prob > 10*independent_prob:
+            if correlated[a, b]:
 
-                for m1 in m1s:
-                    clause = [-1*asgvar[sig1][m1]]
-                    for m2 in m2s:
-                        clause.append(asgvar[sig2][m2])
-                    formula.add_clause(clause)
+                for var1 in vars1:
+                    formula.add_clause([-var1] + vars2)
 
-                for m2 in m2s:
-                    clause = [-1*asgvar[sig2][m2]]
-                    for m1 in m1s:
-                        clause.append(asgvar[sig1][m1])
-                    formula.add_clause(clause)
+                for var2 in vars2:
+                    formula.add_clause([-var2] + vars1)
 
-            elif real_prob*10 < independent_prob:
-                for m1, m2 in itertools.product(m1s, m2s):
-                    formula.add_clause([-asgvar[sig1][m1], -asgvar[sig2][m2]])
+            else:
+                for var1, var2 in itertools.product(vars1, vars2):
+                    formula.add_clause([-var1, -var2])
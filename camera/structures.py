@@ -7,12 +7,35 @@ and the distances between all methyl pairs
 
 import json
 import Bio.PDB
-import itertools
+import functools
+import collections
+import numpy as np
 import networkx as nx
 
+# gemmi parses pdb files in compiled code, BioPython is used without it
+try:
+    import gemmi
+except ImportError:
+    gemmi = None
+
 # Create global pdb parsing object
 PARSER = Bio.PDB.PDBParser(QUIET=True)
 
+# For each residue, the fragments of atom names which pick out the hydrogen
+# and carbon atoms of its methyls, with the label suffix of each methyl
+
+HYDROGENS = {"LEU": (("HD1", ".1"), ("HD2", ".2")),
+             "VAL": (("HG1", ".1"), ("HG2", ".2")),
+             "ALA": (("HB", ""),),
+             "ILE": (("HD", ""),),
+             "MET": (("HE", ""),)}
+
+CARBONS = {"LEU": (("CD1", ".1"), ("CD2", ".2")),
+           "VAL": (("CG1", ".1"), ("CG2", ".2")),
+           "ALA": (("CB", ""),),
+           "ILE": (("CD1", ""),),
+           "MET": (("CE", ""),)}
+
 
 def load_structure(filename):
     """
@@ -24,51 +47,140 @@ def load_structure(filename):
     with open(filename) as infile:
         dic = json.load(infile)
 
-    # Initialize empty set of methyls
-    methyls = set()
+    # Create methyls from the dictionary, in the order they are listed
+    methyls = [Methyl(v["color"], v["seqid"], v["order"], added=v["added"])
+               for v in dic["vertices"]]
 
     # Map from methyl labels to methyl objects
-    label2methyl = {}
-
-    # Add methyls from the dictionary
-    for v in dic["vertices"]:
-
-        # Create new methyl from this entry
-        new_methyl = Methyl(v["color"], v["seqid"], v["order"],
-                            added=v["added"])
-
-        # Add to set of new methyls
-        methyls.add(new_methyl)
-
-        # Create map from label of this methyl to the methyl itself
-        label2methyl[new_methyl.label] = new_methyl
+    label2methyl = {m.label: m for m in methyls}
 
     # Create a graph
     structure = nx.Graph()
     structure.add_nodes_from(methyls)
 
-    # Iterate over edges of the graph
-    for i, j, distances in dic["edges"]:
-        structure.add_edge(label2methyl[i], label2methyl[j],
-                           distances=distances)
+    # Add all edges of the graph at once
+    structure.add_edges_from((label2methyl[i], label2methyl[j],
+                              {"distances": distances})
+                             for i, j, distances in dic["edges"])
 
     # Get set of colors
-    colors = [m.color for m in structure.nodes()]
+    colors = collections.Counter(m.color for m in structure.nodes())
 
-    all_colors = set(colors)
-    for c in sorted(all_colors):
-        print(f"{colors.count(c):2} methyls of type {c}")
+    for c in sorted(colors):
+        print(f"{colors[c]:2} methyls of type {c}")
 
     # return the graph
     print()
     return structure
 
 
+def distance_matrix(structure):
+    """
+    Return a mapping from the methyls of the structure to indices, and a dense
+    matrix of the minimum distance between every pair of methyls under that
+    indexing. Pairs without an edge in the structure are infinitely far apart.
+    The result is computed once and stored on the graph
+    """
+
+    if "distance_matrix" not in structure.graph:
+
+        # Assign each methyl an index
+        index = {m: idx for idx, m in enumerate(structure.nodes())}
+
+        # Fill in the distance between each pair of methyls with an edge
+        matrix = np.full((len(index), len(index)), np.inf)
+
+        for i, j, distances in structure.edges(data="distances"):
+            matrix[index[i], index[j]] = distances[0]
+            matrix[index[j], index[i]] = distances[0]
+
+        structure.graph["distance_matrix"] = index, matrix
+
+    return structure.graph["distance_matrix"]
+
+
+def close_matrix(structure, radius, added_radius):
+    """
+    Return the methyl indexing of distance_matrix, and a boolean matrix which
+    is True for each pair of distinct methyls closer than radius, or closer
+    than added_radius if either methyl was added. The result for each pair of
+    radii is computed once and stored on the graph
+    """
+
+    cache = structure.graph.setdefault("close_matrix", {})
+
+    if (radius, added_radius) not in cache:
+
+        index, matrix = distance_matrix(structure)
+
+        # Use the added radius for every pair involving an added methyl
+        added = np.zeros(len(index), dtype=bool)
+        for m, idx in index.items():
+            added[idx] = m.added
+
+        limit = np.where(added[:, None] | added[None, :], added_radius,
+                         radius)
+
+        # Pairs without an edge, including each methyl with itself, are
+        # infinitely far apart and so never close
+        cache[radius, added_radius] = index, matrix < limit
+
+    return cache[radius, added_radius]
+
+
+def close_methyls(structure, radius, added_radius):
+    """
+    Return a dictionary mapping each methyl of the structure to the set of
+    other methyls close to it, as defined by close_matrix. The result for each
+    pair of radii is computed once and stored on the graph
+    """
+
+    cache = structure.graph.setdefault("close_methyls", {})
+
+    if (radius, added_radius) not in cache:
+
+        index, near = close_matrix(structure, radius, added_radius)
+        methyls = list(index)
+
+        cache[radius, added_radius] = {
+            m: frozenset(methyls[k] for k in np.nonzero(near[index[m]])[0])
+            for m in methyls}
+
+    return cache[radius, added_radius]
+
+
+def geminal_methyls(structure):
+    """
+    Return a dictionary mapping each methyl of the structure to the tuple of
+    methyls that it forms a geminal pair with. The result is computed once and
+    stored on the graph
+    """
+
+    if "geminal_methyls" not in structure.graph:
+
+        # Geminal pairs share a residue, so only compare within residues
+
+        residues = collections.defaultdict(list)
+        for m in structure.nodes():
+            residues[m.seqid].append(m)
+
+        structure.graph["geminal_methyls"] = {
+            m: tuple(o for o in residues[m.seqid] if m.geminal(o))
+            for m in structure.nodes()}
+
+    return structure.graph["geminal_methyls"]
+
+
 class Methyl:
     """
     Object oriented representation of methyls
     """
 
+    # Declare the fields of a Methyl up front so that instances do not each
+    # carry a dictionary
+
+    __slots__ = ("color", "seqid", "order", "label", "added", "label_hash")
+
     def __init__(self, color, seqid, order, added=False):
         """
         Construct a methyl object of given color, sequence id, and order
@@ -82,6 +194,9 @@ class Methyl:
                       if self.order else f"{color}{seqid}")
         self.added = added
 
+        # Methyls are hashed constantly as graph nodes, so hash the label once
+        self.label_hash = hash(self.label)
+
     def geminal(self, other):
         """
         Determine if this methyl and another form a geminal pair
@@ -103,6 +218,14 @@ class Methyl:
 
         return f"methyl:{self.label}"
 
+    def __reduce__(self):
+        """
+        Pickle a methyl by its constructor arguments, so that the label hash
+        is recomputed by the process that unpickles it
+        """
+
+        return Methyl, (self.color, self.seqid, self.order, self.added)
+
     def __eq__(self, other):
         """
         How to determine if this methyl and another are equal
@@ -115,37 +238,74 @@ class Methyl:
         How to hash this object
         """
 
-        return hash(self.label)
+        return self.label_hash
+
+
+@functools.lru_cache(maxsize=8)
+def parse_structure(filename: str):
+    """
+    Parse the given pdb file, remembering the result so that reading methyls
+    and atoms from the same file only parses it once
+    """
+
+    # Use BioPython if gemmi is not installed
+    if gemmi is None:
+        return PARSER.get_structure(f"{filename}", filename)
+
+    # Keep a single conformation of each atom, like BioPython does
+    structure = gemmi.read_structure(filename)
+    structure.remove_alternative_conformations()
+    return structure
 
 
 def get_residues(filename: str, model: int, chain: str):
     """
-    Read in residues from given filename and model and chain
+    Read in residues from given filename and model and chain, as tuples of
+    residue name, sequence id and a list of (atom name, coordinates) pairs
     """
 
-    # Use BioPython to read in the structure
-    models = PARSER.get_structure(f"{filename}", filename)
+    # Read in the structure, reusing an earlier parse
+    models = parse_structure(filename)
+
+    # gemmi identifies models by position and chains by name
+    if gemmi is None:
+        model_ids = [m.id for m in models]
+    else:
+        model_ids = list(range(len(models)))
 
     # Get the desired model if possible
-    if model not in [m.id for m in models]:
+    if model not in model_ids:
         print(f"desired model '{model}' not available in file {filename}")
-        print(f"available models: {sorted(m.id for m in models)}")
+        print(f"available models: {sorted(model_ids)}")
 
     chains = models[model]  # Get all chains in the model
 
+    if gemmi is None:
+        chain_ids = {c.id for c in chains}
+    else:
+        chain_ids = {c.name for c in chains}
+
     # Get the desired chain if possible
-    if chain not in [c.id for c in chains]:
+    if chain not in chain_ids:
         print(f"desired chain '{chain}' not available in file {filename}")
-        print(f"available chain: {sorted(c.id for c in chains)}")
+        print(f"available chain: {sorted(chain_ids)}")
 
         # Use the alphabetically first chain by default
 
-        chain = list(sorted(c.id for c in chains))[0]
+        chain = list(sorted(chain_ids))[0]
 
         print(f"Using chain {chain} by default")
 
-    # get the resideues in chain
-    return chains[chain].get_residues()
+    # get the resideues in chain as a list, so it can be walked repeatedly
+    if gemmi is None:
+        return [(r.get_resname(), r.get_id()[1],
+                 [(a.get_id(), a.coord) for a in r])
+                for r in chains[chain].get_residues()]
+
+    # gemmi may split one chain id into several chains, so gather them all
+    return [(r.name, r.seqid.num,
+             [(a.name, (a.pos.x, a.pos.y, a.pos.z)) for a in r])
+            for c in chains if c.name == chain for r in c]
 
 
 def get_methyls(filename: str, colors: list, model: int, chain: str) -> list:
@@ -161,10 +321,7 @@ def get_methyls(filename: str, colors: list, model: int, chain: str) -> list:
     methyls = set()
 
     # Iterate over residues
-    for r in residues:
-
-        # get color of this residue
-        color = r.get_resname()
+    for color, seqid, atoms in residues:
 
         # Ignore this residue if color not desired
         if color not in colors:
@@ -172,11 +329,11 @@ def get_methyls(filename: str, colors: list, model: int, chain: str) -> list:
 
         # Create two methyls for these
         if color in {"LEU", "VAL"}:
-            methyls.add(Methyl(color[0], r.get_id()[1], 1))
-            methyls.add(Methyl(color[0], r.get_id()[1], 2))
+            methyls.add(Methyl(color[0], seqid, 1))
+            methyls.add(Methyl(color[0], seqid, 2))
 
         else:
-            methyls.add(Methyl(color[0], r.get_id()[1], None))
+            methyls.add(Methyl(color[0], seqid, None))
 
     # return this set of methyls
     return methyls
@@ -184,56 +341,42 @@ def get_methyls(filename: str, colors: list, model: int, chain: str) -> list:
 
 def get_atoms(filename: str, colors: list, model: int, chain: str) -> list:
     """
-    Return a mapping from methyl labels to atoms
+    Return a mapping from methyl labels to arrays holding the coordinates of
+    their hydrogen atoms, one row per atom
     """
 
-    # Get residues from the given structure model and chain
-    residues = get_residues(filename, model, chain)
-
-    # Initialize empty dictionary
-    atom_map = {}
-
-    # Iterate over the residues
-    for res in residues:
-
-        # get color of this methyl
-        color = res.get_resname()
-
-        # If this res does not have desired color, ignore
-        if color not in colors:
-            continue
-
-        # Get the sequence id of this residue
-        seqid = res.get_id()[1]
+    # Collect the hydrogen atoms of each methyl
+    atom_map = get_methyl_atoms(filename, colors, model, chain, HYDROGENS)
 
-        # Get first letter of color
-        c = color[0]
+    # return mapping from methyl names to the coordinates of their atoms
+    return {label: np.array(atoms, dtype=float)
+            for label, atoms in atom_map.items()}
 
-        # Extract the appropriate atoms for methyls of any color
-        if color == "LEU":
-            atom_map[f"{c}{seqid}.1"] = [a for a in res if 'HD1' in a.id]
-            atom_map[f"{c}{seqid}.2"] = [a for a in res if 'HD2' in a.id]
 
-        elif color == "VAL":
-            atom_map[f"{c}{seqid}.1"] = [a for a in res if 'HG1' in a.id]
-            atom_map[f"{c}{seqid}.2"] = [a for a in res if 'HG2' in a.id]
-
-        elif color == "ALA":
-            atom_map[f"{c}{seqid}"] = [a for a in res if 'HB' in a.id]
+def get_carbon_atoms(filename, colors, model, chain):
+    """
+    Return a mapping from methyl labels to the coordinates of their carbon
+    atoms
+    """
 
-        elif color == "ILE":
-            atom_map[f"{c}{seqid}"] = [a for a in res if 'HD' in a.id]
+    # Collect the carbon atoms of each methyl
+    atom_map = get_methyl_atoms(filename, colors, model, chain, CARBONS)
 
-        elif color == "MET":
-            atom_map[f"{c}{seqid}"] = [a for a in res if 'HE' in a.id]
+    # Make sure we got one carbon atom per entry
+    for a in atom_map.keys():
+        assert len(atom_map[a]) == 1
+    atom_map = {a: np.array(atom_map[a][0], dtype=float)
+                for a in atom_map.keys()}
 
-    # return mapping from methyl names to their atoms
+    # return mapping from methyl names to their carbon coordinates
     return atom_map
 
 
-def get_carbon_atoms(filename, colors, model, chain):
+def get_methyl_atoms(filename, colors, model, chain, names):
     """
-    Return a mapping from methyl labels to carbon atoms
+    Return a mapping from methyl labels to the coordinates of their atoms,
+    where names maps each residue name to pairs of an atom name fragment and
+    the suffix of the methyl whose atoms contain that fragment
     """
 
     # Get residues from the given structure model and chain
@@ -243,62 +386,86 @@ def get_carbon_atoms(filename, colors, model, chain):
     atom_map = {}
 
     # Iterate over the residues
-    for res in residues:
-
-        # get color of this methyl
-        color = res.get_resname()
+    for color, seqid, atoms in residues:
 
         # If this res does not have desired color, ignore
         if color not in colors:
             continue
 
-        # Get the sequence id of this residue
-        seqid = res.get_id()[1]
+        # Make a list of atoms for each methyl of this residue
+        buckets = [(fragment, atom_map.setdefault(f"{color[0]}{seqid}{suffix}",
+                                                  []))
+                   for fragment, suffix in names.get(color, ())]
 
-        # Get first letter of color
-        c = color[0]
+        # Walk the atoms of the residue once, sorting them into methyls
+        for name, xyz in atoms:
+            for fragment, bucket in buckets:
+                if fragment in name:
+                    bucket.append(xyz)
 
-        # Extract the appropriate atoms for methyls of any color
-        if color == "LEU":
-            atom_map[f"{c}{seqid}.1"] = [a for a in res if 'CD1' in a.id]
-            atom_map[f"{c}{seqid}.2"] = [a for a in res if 'CD2' in a.id]
-
-        elif color == "VAL":
-            atom_map[f"{c}{seqid}.1"] = [a for a in res if 'CG1' in a.id]
-            atom_map[f"{c}{seqid}.2"] = [a for a in res if 'CG2' in a.id]
-
-        elif color == "ALA":
-            atom_map[f"{c}{seqid}"] = [a for a in res if 'CB' in a.id]
-
-        elif color == "ILE":
-            atom_map[f"{c}{seqid}"] = [a for a in res if 'CD1' in a.id]
-
-        elif color == "MET":
-            atom_map[f"{c}{seqid}"] = [a for a in res if 'CE' in a.id]
-
-    # Make sure we got one carbon atom per entry
-    for a in atom_map.keys():
-        assert len(atom_map[a]) == 1
-    atom_map = {a: atom_map[a][0] for a in atom_map.keys()}
-
-    # return mapping from methyl names to their atoms
+    # return mapping from methyl names to the coordinates of their atoms
     return atom_map
 
 
 def pairwise_distance(triplet1, triplet2):
     """
-    Takes two triplets of hydrogen atoms and returns the average pairwise
-    distances between them
+    Takes the coordinates of two triplets of hydrogen atoms, as returned by
+    get_atoms, and returns the average pairwise distances between them
     """
 
-    # Initialize a zero sum
-    summation = 0.
+    # Get the squared distance between every pair of hydrogen atoms from this
+    # and the other
+    diffs = triplet1[:, np.newaxis, :] - triplet2[np.newaxis, :, :]
+    squared = (diffs ** 2).sum(axis=-1)
 
-    # Iterate over all pairs of hydrogen atoms from this and the other
-    for alpha, beta in itertools.product(triplet1, triplet2):
+    # Return the average of the distances to the negative sixth, raised to the
+    # negative 1/6
+    return (np.sum(squared ** -3) / 9) ** (-1 / 6)
 
-        # Add distance between this pair to the negative sixth
-        summation += pow(alpha - beta, -6)
 
-    # Return the average of the sum to the negative 1/6
-    return pow(summation/9, -1/6)
+def all_pairwise_distances(triplets, others=None):
+    """
+    Takes a list of coordinate arrays of hydrogen triplets, as returned by
+    get_atoms, and returns the matrix of pairwise_distance between each of
+    them and each triplet in others, or between each pair of them if others
+    is not given
+    """
+
+    # Comparing the triplets among themselves gives a symmetric matrix
+    symmetric = others is None
+    if symmetric:
+        others = triplets
+
+    # Stack the triplets into (N, atoms, 3) arrays, padding any that are
+    # short an atom with NaN so that the missing pairs drop out of the sum
+    def stack(group):
+        width = max((len(t) for t in group), default=0)
+        stacked = np.full((len(group), width, 3), np.nan)
+        for k, t in enumerate(group):
+            stacked[k, :len(t)] = t
+        return stacked
+
+    first, second = stack(triplets), stack(others)
+    matrix = np.empty((len(first), len(second)))
+
+    # Work through blocks of rows so the (rows, N, atoms, atoms) array of
+    # squared distances stays small. A symmetric matrix only needs the
+    # columns from the start of each block onward
+    for start in range(0, len(first), 64):
+        block = first[start:start + 64]
+        begin = start if symmetric else 0
+        diffs = (block[:, np.newaxis, :, np.newaxis, :]
+                 - second[np.newaxis, begin:, np.newaxis, :, :])
+        squared = (diffs ** 2).sum(axis=-1)
+
+        # A triplet is no distance from itself, so silence the division
+        with np.errstate(divide="ignore"):
+            summation = np.nansum(squared ** -3, axis=(-2, -1))
+            matrix[start:start + 64, begin:] = (summation / 9) ** (-1 / 6)
+
+    # Copy the upper triangle of a symmetric matrix into the lower
+    if symmetric:
+        lower = np.tril_indices(len(first), -1)
+        matrix[lower] = matrix.T[lower]
+
+    return matrix
@@ -9,7 +9,9 @@ connected components of size 2 to appear
 
 import tqdm
 import halo
-import itertools
+import contextlib
+import functools
+import multiprocessing
 import networkx as nx
 from . import sat
 from . import ground
@@ -18,11 +20,37 @@ from . import params
 SPIN_STR = "checking a component of size {}..."
 
 
-def reduce_symmetrization_graph(network, signatures, structure):
+def reduce_symmetrization_graph(network, signatures, structure, processes=1):
     """
     Given a network, signatures, and a structure, determine edges of the
     symmetrization graph to delete on the basis of them making the problem
-    unsatisfiable.
+    unsatisfiable. With more than one process, a single pool of workers is
+    started up front and shared by every check
+    """
+
+    # Start the pool before any spinner thread is running, so that no worker
+    # is forked from a process with other threads
+
+    if processes > 1:
+        context = multiprocessing.Pool(processes=processes)
+    else:
+        context = contextlib.nullcontext()
+
+    # The matching sizes are only cached for the duration of this call, so
+    # that no NOEs are held on to once it returns
+
+    try:
+        with context as pool:
+            reduce_loop(network, signatures, structure, pool, processes)
+
+    finally:
+        matching_size.cache_clear()
+
+
+def reduce_loop(network, signatures, structure, pool, processes):
+    """
+    Run the iterations of reduce_symmetrization_graph, handing the pool of
+    workers, if any, to every check
     """
 
     # Run this outer loop until we make a pass over every connected component
@@ -48,21 +76,25 @@ def reduce_symmetrization_graph(network, signatures, structure):
 
         # Check for ground truth being respected
 
-        ground.check_network(network, structure)
+        ground.check_network(network, structure, pool, processes)
 
         # Iterate over living but inactive connected components of the
         # symmetrization graph.
 
         inactive_graph = network.inactive_graph()
 
-        components = nx.connected_component_subgraphs(inactive_graph)
-        components = sorted(components, key=lambda x: x.number_of_nodes())
-        for component in components:
+        components = sorted(nx.connected_components(inactive_graph), key=len)
+        for nodes in components:
+
+            # Look at the component through a view rather than a copy
+
+            component = inactive_graph.subgraph(nodes)
 
             # Call helper to determine which edges of this component are in
             # no maximum cardinality matchings that preserve SAT
 
-            unseen = test_component(component, network, signatures, structure)
+            unseen = test_component(component, network, signatures, structure,
+                                    pool, processes)
 
             # If there are edges which can deleted, do so and check to see
             # if this creates new components which are small enough to use as
@@ -97,46 +129,46 @@ def reduce_symmetrization_graph(network, signatures, structure):
     # Iterate over complex active components and kill edges which cannot be
     # activated
 
-    ground.check_network(network, structure)
-    clean_components(network, signatures, structure)
+    ground.check_network(network, structure, pool, processes)
+    clean_components(network, signatures, structure, pool, processes)
 
 
-def clean_components(network, signatures, structure):
+def clean_components(network, signatures, structure, pool=None, processes=1):
     """
     Iterate over active complex components of the symmetrization graph and
-    kill all edges whose activation causes the problem to become UNSAT
+    kill all edges whose activation causes the problem to become UNSAT. Edges
+    are tested in the given pool of processes, if any
     """
 
     # Print message
 
     print("Iterating over active complex components to simplify graph\n")
 
-    # Construct satisfiability formula
-
-    formula = sat.ClusteringCSP(signatures, network, structure)
-
     # Get the active components of the network
 
     active = network.active_graph()
 
-    # Iterate over edges of the graph
+    # Collect the edges to test, ignoring those whose endpoints both have
+    # degree 1. The edges are listed before any are killed
 
-    for i, j in tqdm.tqdm(active.edges()):
+    degree = dict(active.degree())
+    edges = [(i, j) for i, j in active.edges()
+             if not degree[i] == degree[j] == 1]
 
-        # If these both have degree 1, then ignore
+    # Run solver assuming each edge is active. The satisfiability formula is
+    # built once, or once per batch of edges in the pool
 
-        if active.degree(i) == active.degree(j) == 1:
-            continue
+    if pool is None:
+        formula = sat.ClusteringCSP(signatures, network, structure)
+        results = [check_matching(formula, [e]) for e in tqdm.tqdm(edges)]
 
-        # Force the edge to be active
-
-        formula.add_aux_clause([formula.activation_variables[i][j]])
-
-        # Run solver, and if the result in UNSAT kill i, j
+    else:
+        results = check_matchings(signatures, network, structure, None,
+                                  [[e] for e in edges], pool, processes)
 
-        result = formula.solve()
-        formula.flush()
+    # Kill every edge whose activation makes the result UNSAT
 
+    for (i, j), result in zip(edges, results):
         if not result:
             network.kill(i, j)
 
@@ -144,11 +176,63 @@ def clean_components(network, signatures, structure):
     print()
 
 
-def test_component(component, network, signatures, structure):
+def check_matchings(signatures, network, structure, candidates, matchings,
+                    pool=None, processes=1):
+    """
+    Check each of the matchings with check_matching, and return the results
+    in order. With a pool the matchings are split into one batch per process,
+    but never into more batches than there are matchings, and each batch
+    builds the formula once in its worker
+    """
+
+    batches = min(processes, len(matchings)) if pool is not None else 1
+
+    if batches <= 1:
+        return check_batch((signatures, network, structure, candidates,
+                            matchings))
+
+    # Send the candidates as a plain graph rather than a view of the network
+
+    if candidates is not None:
+        candidates = nx.Graph(candidates)
+
+    size = -(-len(matchings) // batches)
+    tasks = [(signatures, network, structure, candidates,
+              matchings[k:k + size]) for k in range(0, len(matchings), size)]
+
+    return [result for results in pool.map(check_batch, tasks)
+            for result in results]
+
+
+def check_batch(task):
+    """
+    Build the satisfiability formula once for a batch of matchings, and check
+    each matching against it
+    """
+
+    signatures, network, structure, candidates, matchings = task
+
+    formula = sat.ClusteringCSP(signatures, network, structure, candidates)
+
+    return [check_matching(formula, m) for m in matchings]
+
+
+def check_matching(formula, matching):
+    """
+    Check whether the formula remains satisfiable when every edge of the
+    matching is active
+    """
+
+    return bool(formula.solve([formula.activation_variables[i][j]
+                               for i, j in matching]))
+
+
+def test_component(component, network, signatures, structure, pool=None,
+                   processes=1):
     """
     Iterate over the maximum cardinality matchings of the given component. For
     each matching, test whether its activation causes satisfiability to be
-    broken
+    broken. Matchings are tested in the given pool of processes, if any
     """
 
     text = SPIN_STR.format(component.number_of_nodes())
@@ -158,24 +242,32 @@ def test_component(component, network, signatures, structure):
 
     unseen = set(component.edges())
 
-    # Iterate over the max cardinality matchings of the graph
+    # Get the max cardinality matchings of the graph. A component with at
+    # most one edge is its own maximum matching
 
-    for matching in max_matchings(component):
+    if component.number_of_edges() <= 1:
+        matchings = [tuple(component.edges())]
+
+    else:
+        matchings = list(max_matchings(component))
 
-        # Activate the edges of the matching and test for satisfiability
+    # Test each matching. Each test solves a formula, built once per batch
+    # with the edges of the component free to be activated, under the
+    # assumption that the edges of the matching are active
 
-        for i, j in matching:
-            network.activate(i, j)
+    results = check_matchings(signatures, network, structure, component,
+                              matchings, pool, processes)
 
-        if checksat(network, signatures, structure):
+    # Mark the edges of every matching that preserves satisfiability
+
+    for matching, result in zip(matchings, results):
+
+        if result:
 
             for m in matching:
                 if m in unseen:
                     unseen.remove(m)
 
-        for i, j in matching:
-            network.deactivate(i, j)
-
     if unseen:
         spinner.succeed(f"{text} removed {len(unseen)} edges")
 
@@ -213,10 +305,51 @@ def max_matchings(graph):
     Return an itertor over the maximum cardinality matchings of the graph
     """
 
-    matching_size = len(nx.max_weight_matching(graph, maxcardinality=True))
+    # Get the edges once, and the size of a maximum matching from the cache
 
-    for matching in itertools.combinations(graph.edges(), matching_size):
+    edges = list(graph.edges())
+    size = matching_size(frozenset(frozenset(e) for e in edges))
+
+    # Grow matchings one edge at a time in edge order, only ever adding an
+    # edge whose endpoints are both free. This yields the same matchings in
+    # the same order as testing every combination of edges, but never builds
+    # a combination that shares a vertex. A branch is dropped as soon as too
+    # few edges remain to complete a maximum matching
+
+    def extend(start, matching, used):
+
+        if len(matching) == size:
+            yield tuple(matching)
+            return
+
+        for idx in range(start, len(edges) - (size - len(matching)) + 1):
+
+            i, j = edges[idx]
+
+            if i in used or j in used:
+                continue
+
+            matching.append(edges[idx])
+            used.update((i, j))
+
+            yield from extend(idx + 1, matching, used)
+
+            matching.pop()
+            used.difference_update((i, j))
+
+    yield from extend(0, [], set())
+
+
+@functools.lru_cache(maxsize=1024)
+def matching_size(edges):
+    """
+    Return the size of a maximum cardinality matching of the graph with the
+    given frozenset of edges. Results are cached, so a component that is
+    revisited by a later iteration of reduce_symmetrization_graph is only
+    matched once. The cache is bounded, and reduce_symmetrization_graph
+    clears it when it returns
+    """
 
-        if nx.is_matching(graph, matching):
+    graph = nx.Graph([tuple(e) for e in edges])
 
-            yield matching
+    return len(ground.max_cardinality_matching(graph))
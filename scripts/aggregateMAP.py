@@ -23,28 +23,26 @@ def main():
     assignments = {}
     for t in trials:
         with open(t) as infile:
-            lines = infile.readlines()
-            start = None
 
-            for idx, line in enumerate(lines):
+            # skip ahead to the predictions
+            for line in infile:
                 if line.startswith("Methyl Assignment Predictions:"):
-                    start = idx + 1
                     break
 
-            if not start:
+            else:
                 print("SHIT")
                 exit()
 
-            lines = lines[start:]
-            for l in lines[:-1]:
-                id, col, atom, _, id1, col1, atom1, *rest = l.split()
+            # read the predictions as they stream past, one line behind,
+            # since the last line of the file is not a prediction
+            previous = next(infile, None)
+            for line in infile:
+                id, col, atom, _, id1, col1, atom1, *rest = previous.split()
                 h_vertex = "-".join([col, id, atom])
                 g_vertex = "-".join([col1, id1, atom1])
 
-                if h_vertex not in assignments:
-                    assignments[h_vertex] = set()
-
-                assignments[h_vertex].add(g_vertex)
+                assignments.setdefault(h_vertex, set()).add(g_vertex)
+                previous = line
 
     for a in assignments:
         print(a, assignments[a])
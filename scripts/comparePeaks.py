@@ -6,7 +6,6 @@ Comparing the peaks in 300ms vs 50ms experiments
 """
 
 import argparse
-import itertools
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -34,56 +33,49 @@ if __name__ == "__main__":
     X_gem = []
     Y_gem = []
 
-    # iterate over the rows of the 50 ms file
-    for idx, entry in short.iterrows():
-
-        # get coordinates
-        c1 = entry["c1"]
-        c2 = entry["c2"]
-        h2 = entry["h2"]
-
-        # ignore diagonals
-        if abs(c1 - c2) < 0.15:
-            continue
-
-        # match receiver
-        receiver = hmqc[(abs(hmqc["carbon"] - c2) < 0.2)
-                        & (abs(hmqc["hydrogen"] - h2) < 0.02)]
-
-        # match sender
-        sender = hmqc[abs(hmqc["carbon"] - c1) < 0.2]
-
-        if receiver.empty or sender.empty:
-            continue
-
-        # go over pairs of assignments
-        for i, j in itertools.product(receiver["assignment"],
-                                      sender["assignment"]):
-            # check for geminality
-            if i[:-1] == j[:-1]:
-                geminal = True
-                break
-
-        else:  # not a geminal
-            geminal = False
-
-        # find the same NOEs in the 300ms file
-        match = long[(abs(long["c1"] - c1) < 0.1)
-                     & (abs(long["c2"] - c2) < 0.1)
-                     & (abs(long["h2"] - h2) < 0.01)]
-
-        if not match.empty:  # if there were matches, plot intensity
-
-            # if np.mean(match["intensity"]) > 7*(10**7):
-            #     print(c1, c2, h2)
-
-            if geminal:
-                X_gem.append(entry["intensity"])
-                Y_gem.append(np.mean(match["intensity"]))
-
-            else:  # otherwise ignore this
-                X.append(entry["intensity"])
-                Y.append(np.mean(match["intensity"]))
+    # get the coordinates of the 50 ms NOEs as columns, so that each NOE
+    # can be compared against every peak of the other files at once
+    c1 = short["c1"].values[:, np.newaxis]
+    c2 = short["c2"].values[:, np.newaxis]
+    h2 = short["h2"].values[:, np.newaxis]
+
+    # match receivers and senders of every NOE
+    receivers = ((abs(hmqc["carbon"].values - c2) < 0.2)
+                 & (abs(hmqc["hydrogen"].values - h2) < 0.02))
+    senders = abs(hmqc["carbon"].values - c1) < 0.2
+
+    # find the same NOEs in the 300ms file
+    matches = ((abs(long["c1"].values - c1) < 0.1)
+               & (abs(long["c2"].values - c2) < 0.1)
+               & (abs(long["h2"].values - h2) < 0.01))
+
+    # keep NOEs which are not diagonals, have a receiver and a sender, and
+    # appear in the 300ms file
+    keep = ((abs(c1 - c2)[:, 0] >= 0.15) & receivers.any(axis=1)
+            & senders.any(axis=1) & matches.any(axis=1))
+
+    assignments = hmqc["assignment"].values
+    long_intensity = long["intensity"].values
+
+    # iterate over the kept rows of the 50 ms file
+    for idx in np.flatnonzero(keep):
+
+        # check for geminality by looking for a receiver and a sender
+        # assignment that agree up to their last character
+        geminal = bool({i[:-1] for i in assignments[receivers[idx]]}
+                       & {j[:-1] for j in assignments[senders[idx]]})
+
+        # plot intensity against the mean intensity of the matches
+        intensity = short["intensity"].values[idx]
+        mean = np.mean(long_intensity[matches[idx]])
+
+        if geminal:
+            X_gem.append(intensity)
+            Y_gem.append(mean)
+
+        else:  # otherwise ignore this
+            X.append(intensity)
+            Y.append(mean)
 
     # get upper and lower limits for axes
     upper = max(X + Y + X_gem + Y_gem)*(1.05)
@@ -4,7 +4,7 @@ convert a 2D sparky list into a CSV file that contains the same information
 """
 
 import argparse
-import re
+import numpy as np
 import pandas as pd
 
 
@@ -19,54 +19,46 @@ def get_args():
 
 
 def parse_file(fname):
-    """Parse sparky list into a series of triplets"""
-    matcher = re.compile(r"^([AILVMT])([0-9]+)[CQH][BGED]([12]?)")
+    """Parse sparky list into a table of peaks"""
+    pattern = r"^([AILVMT])([0-9]+)[CQH][BGED]([12]?)"
 
-    # read in the file
+    # read in the label and the two shifts from each line of the file
     with open(fname) as file:
-        lines = file.readlines()
+        fields = [(line.split() + ["", "", ""])[:3] for line in file]
 
-    # initialize empty list of peaks
-    peaks = []
+    lines = pd.DataFrame(fields, columns=["label", "carbon", "hydrogen"])
 
-    # iterate over input lines
-    for idx, line in enumerate(lines):
+    # get assignment information from all labels at once
+    parts = lines["label"].str.extract(pattern)
+    color, seqid, order = parts[0], parts[1], parts[2]
+    carbon = pd.to_numeric(lines["carbon"], errors="coerce").astype(float)
+    hydrogen = pd.to_numeric(lines["hydrogen"], errors="coerce").astype(float)
+    lv = color.isin(["L", "V"])
 
-        try:  # try to parse, print issue if it doesn't work
+    # print where any issues happened
+    bad = (color.isna() | carbon.isna() | hydrogen.isna()
+           | (lv & (order == "")))
+    for idx in np.flatnonzero(bad):
+        print(f"Bad peak on line {idx + 1}")
 
-            label, carbon, hydrogen, *rest = line.split()  # split the line
+    # name each methyl, and its geminal partner if it has one
+    residue = color + seqid
+    label = residue.where(~lv, residue + "." + order)
+    geminal = (residue + "." + order.map({"1": "2", "2": "1"})).where(lv, "")
 
-            # get assignment information from the label
-            color, id, order = matcher.match(label).groups()
-            lv = color in ["L", "V"]
-            label = f"{color}{id}.{order}" if lv else f"{color}{id}"
+    peaks = pd.DataFrame({"label": label, "assignment": label + " " + geminal,
+                          "geminal": geminal, "color": color,
+                          "carbon": carbon, "hydrogen": hydrogen})
 
-            # add of
-            if lv:
-                geminal = f"{color}{id}.{3 - int(order)}"
-            else:
-                geminal = ""
-
-            asg = label + " " + geminal
-
-            peaks.append([label, asg, geminal, color, float(carbon),
-                          float(hydrogen)])
-
-        # print where any issues happened
-        except (AttributeError, ValueError):
-            print(f"Bad peak on line {idx + 1}")
-
-    # return peak list
-    return peaks
+    # return peak table
+    return peaks[~bad].reset_index(drop=True)
 
 
 def main():
     """Main method for the script"""
     args = get_args()
     peaks = parse_file(args.list)
-    csv = pd.DataFrame(peaks, columns=["label", "assignment", "geminal",
-                                       "color", "carbon", "hydrogen"])
-    csv.to_csv(args.output, index=False)
+    peaks.to_csv(args.output, index=False)
 
 
 # run main method for the script
@@ -29,9 +29,8 @@ def main():
         print("ERROR! cluster and noe are required columns in the input csv")
         exit(1)
 
-    noes = {(row["noe"][:row["noe"].rfind(".")],
-             row["cluster"][:row["cluster"].rfind(".")])
-            for _, row in csv.iterrows()}
+    noes = {(noe[:noe.rfind(".")], cluster[:cluster.rfind(".")])
+            for noe, cluster in zip(csv["noe"], csv["cluster"])}
 
     noes = {(a, b) for a, b in noes if a != b}  # filter out diagonals
 
@@ -35,10 +35,9 @@ def main():
 
     with open(args.output, "w") as outf:
 
-        for _, peak in csv.iterrows():
+        for c1, c2, h2 in zip(csv["c1"], csv["c2"], csv["h2"]):
 
-            outf.write(f"?-?-?  {peak['c1']:.3f}   {peak['c2']:.3f}   "
-                       f"{peak['h2']:.3f}\n")
+            outf.write(f"?-?-?  {c1:.3f}   {c2:.3f}   {h2:.3f}\n")
 
 
 if __name__ == "__main__":
@@ -25,38 +25,22 @@ def main():
     csv1 = pandas.read_csv(args.csv1)
     csv2 = pandas.read_csv(args.csv2)
 
-    # iterate over the rows of the first csv file
-    for idx, series in csv1.iterrows():
-
-        # get all entries with the same label
-        matches = csv2[csv2["label"] == series["label"]]
-
-        # if unique, we will print the movement
-        if len(matches) == 1:
-
-            # get the unique match
-            match = matches.iloc[0]
-
-            # get the movement
-            delta_c1 = abs(series["c1"] - match["c1"])
-            delta_c2 = abs(series["c2"] - match["c2"])
-            delta_h2 = abs(series["h2"] - match["h2"])
-            delta_intensity = abs(series["intensity"] - match["intensity"])
-
-            if delta_c1 < 0.15 and delta_c2 < 0.15 and delta_h2 < 0.02:
-                continue
-
-            # # print the difference
-            # print(f"{series['label']:>20} {delta_c1:5.3f} {delta_c2:5.3f} "
-            #       f"{delta_h2:5.3f} {delta_intensity:5.2E}")
-            # print(f"{series['label']:>20} {series['c1']:5.3f} "
-            #       f"{series['c2']:5.3f} {series['h2']:5.3f} "
-            #       f"{series['intensity']:5.2E}")
-            # print(f"{series['label']:>20} {match['c1']:5.3f} "
-            #       f"{match['c2']:5.3f} {match['h2']:5.3f} "
-            #       f"{match['intensity']:5.2E}")
-            # print()
-            print(series["label"])
+    # pair each row of the first csv file with the entry of the second that
+    # has the same label, when that entry is unique
+    counts = csv2["label"].value_counts()
+    unique = csv2[csv2["label"].map(counts) == 1]
+    pairs = csv1.merge(unique, on="label", suffixes=("", "_match"))
+
+    # get the movement
+    delta_c1 = abs(pairs["c1"] - pairs["c1_match"])
+    delta_c2 = abs(pairs["c2"] - pairs["c2_match"])
+    delta_h2 = abs(pairs["h2"] - pairs["h2_match"])
+
+    # print the labels of the peaks that moved
+    still = (delta_c1 < 0.15) & (delta_c2 < 0.15) & (delta_h2 < 0.02)
+    for label in pairs["label"][~still]:
+        print(label)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,17 @@
+"""
+Write tables of peaks out in the format given by the name of the output file
+"""
+
+
+def write_table(table, filename):
+    """
+    Write the table as parquet or feather when the file is named so, for
+    readers in python, and as csv otherwise
+    """
+
+    if filename.endswith(".parquet"):
+        table.to_parquet(filename, index=False)
+    elif filename.endswith(".feather"):
+        table.to_feather(filename)
+    else:
+        table.to_csv(filename, index=False)
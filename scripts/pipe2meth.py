@@ -5,74 +5,47 @@ Convert nmrpipe peak table into a csv with only the relevant rows
 
 import argparse
 import itertools
+import numpy as np
 import pandas as pd
-import networkx as nx
+import peaktables
 
 
-class Peak:
+def connected_pairs(peaks, ctol, htol):
     """
-    Class for storing peaks so that we can eliminate duplicates using a
-    connected component algorithm
+    Yield the pairs of rows of the peak table that are close enough in space
+    to be connected. Peaks are only compared with peaks of the same type, and
+    after sorting them along one axis each peak is compared in one vectorized
+    step with the peak k places after it, for increasing k, until no such
+    pair is within the tolerance on that axis
     """
 
-    def __init__(self, dict):
-        """
-        Construct from dictionary
-        """
+    # cch peaks are compared on c1, c2 and h2, hch peaks on h1, c2 and h2
+    for kind, axes, tols in (("cch", ["c1", "c2", "h2"], (ctol, ctol, htol)),
+                             ("hch", ["h1", "c2", "h2"], (htol, ctol, htol))):
 
-        # determine if this is an HCH or CCH peak
-        self.type = "cch" if "c1" in dict else "hch"
+        group = np.flatnonzero(peaks["type"].values == kind)
+        coords = peaks[axes].values[group]
 
-        # set c1 and h1 depending on cch or hch
-        self.c1 = float(dict["c1"]) if self.type == "cch" else 0.
-        self.h1 = float(dict["h1"]) if self.type == "hch" else 0.
+        # sort the peaks along the axis spanning the most tolerance widths,
+        # which leaves the fewest peaks within the tolerance of each other on
+        # it and so rejects the most pairs before the other axes are checked
+        axis = np.argmax(np.ptp(coords, axis=0) / tols) if len(coords) else 0
+        order = np.argsort(coords[:, axis], kind="stable")
+        group, coords = group[order], coords[order]
 
-        # set ch and h2 coordinates
-        self.c2 = float(dict["c2"])
-        self.h2 = float(dict["h2"])
+        # the peaks within the tolerance of a peak on that axis directly
+        # follow it, so the peaks still to compare only ever shrink with k
+        starts = np.arange(len(coords))
+        for k in itertools.count(1):
+            starts = starts[starts + k < len(coords)]
+            starts = starts[coords[starts + k, axis] - coords[starts, axis]
+                            < tols[axis]]
+            if not len(starts):
+                break
 
-        # set intensity
-        self.intensity = float(dict["intensity"])
-
-    def connected(self, other, ctol, htol):
-        """
-        Determine if these are close enough in space to be connected
-        """
-
-        assert self.type == other.type  # only compare NOEs of same type
-
-        if self.type == "cch":
-            return (abs(self.c1 - other.c1) < ctol
-                    and abs(self.c2 - other.c2) < ctol
-                    and abs(self.h2 - other.h2) < htol)
-        else:
-            return (abs(self.h1 - other.h1) < htol
-                    and abs(self.c2 - other.c2) < ctol
-                    and abs(self.h2 - other.h2) < htol)
-
-
-def component_to_dict(component, name):
-    """Return a dictionary representation of single cluster of noes"""
-
-    size = component.number_of_nodes()  # save size of component
-
-    # initialize attributes
-    c1 = 0.
-    c2 = 0.
-    h1 = 0.
-    h2 = 0.
-    intensity = 0.
-
-    for node in component.nodes():
-        c1 += node.c1/size
-        c2 += node.c2/size
-        h1 += node.h1/size
-        h2 += node.h2/size
-        intensity += node.intensity/size
-
-    # return a blank dictionary
-    return {"label": name, "c1": c1, "c2": c2, "h1": h1, "h2": h2,
-            "intensity": intensity}
+            near = starts[np.all(abs(coords[starts + k] - coords[starts])
+                                 < tols, axis=-1)]
+            yield from zip(group[near], group[near + k])
 
 
 def get_args():
@@ -81,7 +54,8 @@ def get_args():
     """
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("peaklist", type=str, help="pipe peaklist")
-    parser.add_argument("output", type=str, help="output file")
+    parser.add_argument("output", type=str,
+                        help="output csv, parquet or feather file")
     parser.add_argument("--ctol", type=float, default=0.1,
                         help="carbon tolerance from duplicate removal")
     parser.add_argument("--htol", type=float, default=0.01,
@@ -95,47 +69,34 @@ def parse_pipe(fname, order=["h2", "c1", "c2"]):
 
     w1, w2, w3 = order  # get the order of axes
 
-    with open(fname) as file:  # read in the pipe file
-        lines = file.readlines()
-
     # find the line where the peaks declarations begin
-    for idx, line in enumerate(lines):
-        if line.startswith("VARS"):
-            lines = lines[idx:]
-            break
-
-    # get variable names and entries
-    vars = lines[0].split()[1:]
-    entries = [e.split() for e in lines[2:]]
-    new_entries = []
-
-    # iterate over the entries of this table
-    for idx, entry in enumerate(entries):
-
-        new_entry = {"label": f"peak{idx}"}
-
-        # iterate over attributes of the peak
-        for v, e in zip(vars, entry):
-
-            if v == "X_PPM":
-                new_entry[w1] = e
-
-            elif v == "Y_PPM":
-                new_entry[w2] = e
-
-            elif v == "Z_PPM":
-                new_entry[w3] = e
-
-            elif v == "HEIGHT":
-                new_entry["intensity"] = e
-
-        # add this new entry
-        if len(new_entry.keys()) == 5:
-            if float(new_entry["intensity"]) > 0:
-                new_entries.append(Peak(new_entry))
-
-    # return new peak list
-    return new_entries
+    with open(fname) as file:
+        for start, line in enumerate(file):
+            if line.startswith("VARS"):
+                break
+
+    # get variable names, and read the entries which follow the format line
+    vars = line.split()[1:]
+    table = pd.read_csv(fname, sep=r"\s+", skiprows=start + 2, names=vars,
+                        index_col=False, float_precision="round_trip")
+
+    # keep the axes and the height, dropping incomplete entries and those
+    # without a positive intensity
+    table = table.rename(columns={"X_PPM": w1, "Y_PPM": w2, "Z_PPM": w3,
+                                  "HEIGHT": "intensity"})
+    table = table.reindex(columns=[w1, w2, w3, "intensity"]).dropna()
+    table = table[table["intensity"] > 0]
+
+    # mark the type of the peaks, filling in the axis that this type of peak
+    # does not have
+    table = table.reset_index(drop=True)
+    table["type"] = "cch" if "c1" in order else "hch"
+    for axis in ["c1", "h1"]:
+        if axis not in table:
+            table[axis] = 0.
+
+    # return the peaks as columns of coordinates
+    return table[["type", "c1", "c2", "h1", "h2", "intensity"]]
 
 
 def main():
@@ -144,22 +105,36 @@ def main():
     peaks = parse_pipe(args.peaklist, order=args.order)
     print(f"collected {len(peaks)} from table")
 
-    final_list = []
+    # join connected peaks into clusters with a union-find over their
+    # positions, always keeping the earliest peak of a cluster as its root
+    parent = list(range(len(peaks)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in connected_pairs(peaks, args.ctol, args.htol):
+        a, b = find(i), find(j)
+        parent[max(a, b)] = min(a, b)
+
+    # number the clusters in the order they first appear
+    number = {}
+    labels = np.array([number.setdefault(find(idx), len(number))
+                       for idx in range(len(peaks))], dtype=int)
+    sizes = np.bincount(labels, minlength=len(number))
 
-    # construct a graph to eliminate duplicates
-    graph = nx.Graph()
-    graph.add_nodes_from(peaks)
-    for i, j in itertools.combinations(peaks, 2):
-        if i.connected(j, args.ctol, args.htol):
-            graph.add_edge(i, j)
+    # average the coordinates and intensity of the peaks of each cluster
+    csv = pd.DataFrame({"label": [f"peak{idx}" for idx in range(len(number))]})
+    for field in ["c1", "c2", "h1", "h2", "intensity"]:
+        csv[field] = np.bincount(labels, weights=peaks[field].values,
+                                 minlength=len(number)) / sizes
 
-    # iterate over connected components of this graph
-    for idx, cc in enumerate(nx.connected_component_subgraphs(graph)):
-        final_list.append(component_to_dict(cc, f"peak{idx}"))
+    csv = csv[["label", "c1", "c2", "h2", "intensity"]]
 
-    csv = pd.DataFrame(final_list)  # construct dataframe
-    csv.to_csv(args.output, index=False,
-               columns=["label", "c1", "c2", "h2", "intensity"])
+    # write out in the format named by the output file
+    peaktables.write_table(csv, args.output)
 
 
 if __name__ == "__main__":
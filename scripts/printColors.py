@@ -11,23 +11,32 @@ import pandas
 def get_args():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument("file", type=str, help="csv file to be read")
+    parser.add_argument("file", type=str,
+                        help="csv, parquet or feather file to be read")
     return parser.parse_args()
 
 
 def main():
     """Main method for script"""
     args = get_args()
-    csv = pandas.read_csv(args.file, na_filter=False)
-    colors = set(filter(None, csv["color"].tolist()))  # filter out empty str
-    numbers = {c: 0 for c in colors}
 
-    clusters = set(filter(None, csv["cluster"].tolist()))
-    for c in clusters:
-        numbers[c[0]] += 1
-
-    for key in sorted(numbers.keys()):
-        print(key, numbers[key])
+    # read the spreadsheet in whichever format it was written, with empty
+    # strings for missing entries
+    if args.file.endswith(".parquet"):
+        csv = pandas.read_parquet(args.file).fillna("")
+    elif args.file.endswith(".feather"):
+        csv = pandas.read_feather(args.file).fillna("")
+    else:
+        csv = pandas.read_csv(args.file, na_filter=False)
+
+    # count the distinct clusters of each color, including the colors
+    # without any clusters, ignoring empty strings
+    colors = csv.loc[csv["color"] != "", "color"].unique()
+    clusters = csv.loc[csv["cluster"] != "", "cluster"].drop_duplicates()
+    numbers = clusters.str[0].value_counts().reindex(colors, fill_value=0)
+
+    for key, number in numbers.sort_index().items():
+        print(key, number)
 
 
 if __name__ == "__main__":
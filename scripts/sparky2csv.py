@@ -7,7 +7,9 @@ Converts an un-assigned 3D sparky peak list into a methylphetamine formatted
 """
 
 import argparse
+import numpy as np
 import pandas as pd
+import peaktables
 
 
 def get_args():
@@ -15,7 +17,8 @@ def get_args():
     parser = argparse.ArgumentParser(description=__doc__.strip())
     parser.add_argument("sparkylist", type=str,
                         help="sparky file to be converted")
-    parser.add_argument("output", type=str, help="name of output csv file")
+    parser.add_argument("output", type=str,
+                        help="name of output csv, parquet or feather file")
     parser.add_argument("--hch", action="store_true",
                         help="hch instead of cch")
     return parser.parse_args()
@@ -25,42 +28,30 @@ def main():
     """Main method for the script"""
     args = get_args()
 
-    entries = []
-
     noe_dim = "h1" if args.hch else "c1"  # save the name of the noe dimension
 
-    with open(args.sparkylist) as lines:
-
-        lines = lines.readlines()
-        # lines = set(lines)  # remove duplicate lines
-        peak = 1
-        for idx, line in enumerate(lines):
-            idx = idx + 1
-
-            try:
-                label, c1, c2, h2, intensity, *rest = line.split()
-
-                c1 = float(c1)  # convert these to floats
-                c2 = float(c2)
-                h2 = float(h2)
-                intensity = float(intensity)
+    # read in the label, shifts and intensity from each line of the file
+    with open(args.sparkylist) as file:
+        fields = [(line.split() + [""] * 5)[:5] for line in file]
 
-                label = f"peak{peak}"
-                peak += 1
+    lines = pd.DataFrame(fields, columns=["label", noe_dim, "c2", "h2",
+                                          "intensity"])
 
-            except ValueError:
-                print(f"invalid NOE definition on line {idx}")
-                continue
+    # convert the shifts and intensities of all lines at once
+    columns = [noe_dim, "c2", "h2", "intensity"]
+    csv = lines[columns].apply(pd.to_numeric, errors="coerce").astype(float)
 
-            dic = {"label": label, noe_dim: c1,
-                   "c2": c2, "h2": h2, "intensity": intensity}
+    # print where any issues happened
+    bad = csv.isna().any(axis=1).values
+    for idx in np.flatnonzero(bad):
+        print(f"invalid NOE definition on line {idx + 1}")
 
-            entries.append(dic)
+    # number the valid peaks in order
+    csv = csv[~bad].reset_index(drop=True)
+    csv.insert(0, "label", [f"peak{idx + 1}" for idx in range(len(csv))])
 
-    # create dataframe and write out
-    csv = pd.DataFrame(entries)
-    order = ["label", noe_dim, "c2", "h2", "intensity"]
-    csv.to_csv(args.output, columns=order, index=False)
+    # write out in the format named by the output file
+    peaktables.write_table(csv, args.output)
 
 
 if __name__ == "__main__":
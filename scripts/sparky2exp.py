@@ -33,8 +33,9 @@ email: bcsherma@ucsc.edu
 """
 
 
-import re
 import argparse
+import numpy as np
+import pandas as pd
 
 
 def main():
@@ -52,8 +53,8 @@ def main():
     """
     Regular expression for extracting relevant information from the peak labels
     """
-    peakexpr = re.compile(r"([AILVMT])([1-9][0-9]*)"
-                          r"([CQ][BDG][12]?)-([CQ][BDG][12]?)")
+    peakexpr = (r"^([AILVMT])([1-9][0-9]*)"
+                r"([CQ][BDG][12]?)-([CQ][BDG][12]?)")
 
     """
     Dictionary mapping one letter color identifiers to three letter color
@@ -63,36 +64,44 @@ def main():
                 "M": "MET", "T": "THR"}
 
     """
-    Read in lines from input file and iterate over each one
+    Read in the label and the two shifts from each line of the input file
     """
-    outlines = []
-    with open(args.peaklist) as lines:
+    with open(args.peaklist) as file:
+        fields = [line.split() for line in file]
 
-        lines = lines.readlines()
+    lines = pd.DataFrame([(f + ["", ""])[:3] for f in fields],
+                         columns=["label", "shift1", "shift2"])
+    short = np.array([len(f) < 3 for f in fields], dtype=bool)
 
-        for idx, line in enumerate(lines):
-
-            idx = idx + 1  # extract line number
+    """
+    Extract the relevant information from all of the labels at once, and
+    report the lines which could not be read
+    """
+    parts = lines["label"].str.extract(peakexpr)
+    color, id, atom1, atom2 = (parts[i] for i in range(4))
+    bad = short | color.isna().values
 
-            try:
-                label, shift1, shift2, *rest = line.split()
-                color, id, atom1, atom2 = peakexpr.match(label).groups()
-                atom1 = atom1.replace("Q", "H")
-                atom2 = atom2.replace("Q", "H")
-                outlines.append(f"{id} {colormap[color]} {atom1} {shift1}")
-                outlines.append(f"{id} {colormap[color]} {atom2} {shift2}")
+    for idx in np.flatnonzero(bad):
+        print("invalid peak definition on line", idx + 1)
 
-            except ValueError:
-                print("invalid peak definition on line", idx)
+    """
+    Build the two output rows of each peak, one for each atom, interleaving
+    the rows of the first atoms with those of the second
+    """
+    peaks = pd.DataFrame({"id": id, "residue": color.map(colormap),
+                          "atom1": atom1.str.replace("Q", "H"),
+                          "atom2": atom2.str.replace("Q", "H"),
+                          "shift1": lines["shift1"],
+                          "shift2": lines["shift2"]})[~bad]
 
-            except AttributeError:
-                print("invalid peak definition on line", idx)
+    rows = np.empty((2 * len(peaks), 4), dtype=object)
+    rows[0::2] = peaks[["id", "residue", "atom1", "shift1"]].values
+    rows[1::2] = peaks[["id", "residue", "atom2", "shift2"]].values
 
     """
-    Write the output lines to a file
+    Write the output rows to a file
     """
-    with open(args.output, "w") as outfile:
-        outfile.write("\n".join(outlines) + "\n")
+    pd.DataFrame(rows).to_csv(args.output, sep=" ", header=False, index=False)
 
 
 if __name__ == "__main__":
@@ -7,29 +7,36 @@ Converts an assigned 3D sparky peak list into a methylphetamine formatted
 """
 
 import argparse
-import re
+import bisect
+import collections
+import numpy as np
 import pandas as pd
+import peaktables
 
+PATTERN = (r"^([AILVMT])([1-9][0-9]*)[CQ][BDG]([12]?)"
+           r"-([AILVMT])?([1-9][0-9]*)?[CQ][BDG]([12]?)")
 
-def get_methyl_ids(label):
+
+def get_methyl_ids(labels):
     """
-    Given a label from the 3D list, determine which methyls participate
-    in the NOE and whether or not they comprise a geminal
+    Given the labels from the 3D list, determine which methyls participate
+    in each NOE and whether or not they comprise a geminal. Labels which are
+    not valid give missing methyls
     """
-    matcher = re.compile(r"^([AILVMT])([1-9][0-9]*)[CQ][BDG]([12]?)"
-                         r"-([AILVMT])?([1-9][0-9]*)?[CQ][BDG]([12]?)")
 
-    c1, g1, o1, c2, g2, o2 = matcher.match(label).groups()  # run regex
+    # run the regex over all of the labels at once
+    parts = labels.str.extract(PATTERN)
+    c1, g1, o1, c2, g2, o2 = (parts[i] for i in range(6))
 
-    assert (c2 and g2) or (not c2 and not g2)
+    assert (c2.notna() == g2.notna())[c1.notna()].all()
 
-    if not c2:  # if no color, this is a geminal or diagonal
-        c2 = c1
-        g2 = g1
+    # if no color, this is a geminal or diagonal
+    c2 = c2.fillna(c1)
+    g2 = g2.fillna(g1)
 
     # set labels according to color
-    l1 = f"{c1}{g1}.{o1}" if c1 in ["L", "V"] else f"{c1}{g1}"
-    l2 = f"{c2}{g2}.{o2}" if c2 in ["L", "V"] else f"{c2}{g2}"
+    l1 = (c1 + g1).where(~c1.isin(["L", "V"]), c1 + g1 + "." + o1)
+    l2 = (c2 + g2).where(~c2.isin(["L", "V"]), c2 + g2 + "." + o2)
 
     return l1, l2
 
@@ -39,7 +46,8 @@ def get_args():
     parser = argparse.ArgumentParser(description=__doc__.strip())
     parser.add_argument("sparkylist", type=str,
                         help="sparky file to be converted")
-    parser.add_argument("output", type=str, help="name of output csv file")
+    parser.add_argument("output", type=str,
+                        help="name of output csv, parquet or feather file")
     parser.add_argument("--hch", action="store_true",
                         help="hch instead of cch")
     return parser.parse_args()
@@ -49,69 +57,84 @@ def main():
     """Main method for the script"""
     args = get_args()
 
-    entries = []
+    # read in the label, shifts and intensity from each line of the file
+    with open(args.sparkylist) as file:
+        fields = [line.split() for line in file]
 
-    with open(args.sparkylist) as lines:
+    lines = pd.DataFrame([(f + [""] * 5)[:5] for f in fields],
+                         columns=["label", "c1", "c2", "h2", "intensity"])
+    short = np.array([len(f) < 5 for f in fields], dtype=bool)
 
-        lines = lines.readlines()
-        for idx, line in enumerate(lines):
-            idx = idx + 1
+    # get the methyls of all labels at once
+    sender, receiver = get_methyl_ids(lines["label"])
 
-            try:
-                label, c1, c2, h2, intensity, *rest = line.split()
-                sender, receiver = get_methyl_ids(label)
+    # print where any issues happened
+    for idx in np.flatnonzero(short | receiver.isna().values):
+        if short[idx]:
+            print(f"invalid NOE definition on line {idx + 1}")
+        else:
+            print(f"invalid NOE label on line {idx + 1}")
 
-            except ValueError:
-                print(f"invalid NOE definition on line {idx}")
-                continue
+    table = lines.assign(cluster=receiver, assignment=receiver, noe=sender,
+                         color=receiver.str[0])
+    table = table[~short & receiver.notna().values]
 
-            except AttributeError:
-                print(f"invalid NOE label on line {idx}")
-                continue
+    # keep the columns needed to pair up reciprocals as plain lists
+    clusters = table["cluster"].tolist()
+    senders = table["noe"].tolist()
+    labels = table["label"].tolist()
+    colors = table["color"].tolist()
 
-            dic = {"cluster": receiver, "assignment": receiver, "noe": sender,
-                   "label": label, "c1": c1, "c2": c2, "h2": h2,
-                   "intensity": intensity, "color": receiver[0]}
+    reciprocal = [None] * len(labels)
+    geminal = [None] * len(labels)
 
-            entries.append(dic)
+    # index the positions of the NOEs by their cluster and noe, so that the
+    # reciprocals of an NOE can be looked up instead of searched for
+    positions = collections.defaultdict(list)
+    for idx, key in enumerate(zip(clusters, senders)):
+        positions[key].append(idx)
 
-    for idx, dic in enumerate(entries):
+    for idx in range(len(labels)):
 
         """
         Iterate over NOEs to identify reciprocals
         """
 
-        if "reciprocal" in dic:
+        if reciprocal[idx] is not None:
             continue
 
-        a = dic["noe"]
-
-        b = dic["cluster"]
+        # the reciprocals are the later NOEs from this cluster to this noe
+        others = positions.get((senders[idx], clusters[idx]), [])
 
-        for jdx, dic2 in enumerate(entries[idx+1:]):
-            if dic2["cluster"] == a:
-                if dic2["noe"] == b:
+        for jdx in others[bisect.bisect_right(others, idx):]:
 
-                    """
-                    Point these NOEs to each other
-                    """
-                    entries[idx]["reciprocal"] = dic2["label"]
-                    entries[idx + jdx + 1]["reciprocal"] = dic["label"]
+            """
+            Point these NOEs to each other
+            """
+            reciprocal[idx] = labels[jdx]
+            reciprocal[jdx] = labels[idx]
 
-                    """
-                    If these are geminals, identify them as such in the
-                    geminal column
-                    """
-                    if dic["cluster"][:-1] == dic2["cluster"][:-1]:
-                        if dic["color"] in ["L", "V"]:
-                            entries[idx]["geminal"] = dic2["label"]
-                            entries[idx + jdx + 1]["geminal"] = dic["label"]
+            """
+            If these are geminals, identify them as such in the
+            geminal column
+            """
+            if clusters[idx][:-1] == clusters[jdx][:-1]:
+                if colors[idx] in ["L", "V"]:
+                    geminal[idx] = labels[jdx]
+                    geminal[jdx] = labels[idx]
 
-    csv = pd.DataFrame(entries)
+    csv = table.assign(reciprocal=reciprocal, geminal=geminal)
     order = ["label", "assignment", "color", "cluster", "noe", "reciprocal",
              "geminal", "c1", "c2", "h2", "intensity"]
+    csv = csv[order]
+
+    # the shifts and intensities are kept as they were written in the list,
+    # so give them their numeric types for the binary formats
+    if args.output.endswith((".parquet", ".feather")):
+        csv = csv.astype({c: float for c in ["c1", "c2", "h2", "intensity"]})
 
-    csv.to_csv(args.output, columns=order, index=False)
+    # write out in the format named by the output file
+    peaktables.write_table(csv, args.output)
 
 
 if __name__ == "__main__":
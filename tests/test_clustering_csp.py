@@ -7,6 +7,7 @@ Run tests on the clustering CSP
 
 import os
 import unittest
+import collections
 import networkx as nx
 import camera.sat as sat
 import camera.hmqc as hmqc
@@ -21,36 +22,46 @@ class TestClusteringCSP(unittest.TestCase):
     Run tests on the clustering CSP
     """
 
-    params.RADIUS = 10
-    params.SHORT_RADIUS = 8
+    @classmethod
+    def setUpClass(cls):
+        """
+        Build the formula once for every test, and solve it once since every
+        test inspects the same solution
+        """
+
+        params.RADIUS = 10
+        params.SHORT_RADIUS = 8
+
+        test_dir = os.path.dirname(__file__) + "/hnh/"
 
-    test_dir = os.path.dirname(__file__) + "/hnh/"
+        cls.signatures = hmqc.parse_hmqc_file(test_dir + "hmqc.csv")
 
-    signatures = hmqc.parse_hmqc_file(test_dir + "hmqc.csv")
+        crosspeaks = noes.parse_noe_file(test_dir + "merged.csv")
 
-    crosspeaks = noes.parse_noe_file(test_dir + "merged.csv")
+        noes.set_clusters(crosspeaks, cls.signatures)
+        noes.set_reciprocals(crosspeaks)
 
-    noes.set_clusters(crosspeaks, signatures)
-    noes.set_reciprocals(crosspeaks)
+        cls.crosspeaks = [c for c in crosspeaks if c.clusters]
 
-    crosspeaks = [c for c in crosspeaks if c.clusters]
+        cls.symgraph = network.SymGraph(cls.crosspeaks, True)
+        cls.symgraph.ignore_geminals(cls.signatures)
+        cls.symgraph.histogram()
 
-    symgraph = network.SymGraph(crosspeaks, True)
-    symgraph.ignore_geminals(signatures)
-    symgraph.histogram()
+        cls.structure = structures.load_structure(test_dir + "g100.json")
+        hmqc.set_assignment(cls.signatures, cls.structure)
+        cls.symgraph.set_activity_level(3)
 
-    structure = structures.load_structure(test_dir + "g100.json")
-    hmqc.set_assignment(signatures, structure)
-    symgraph.set_activity_level(3)
+        cls.formula = sat.ClusteringCSP(cls.signatures, cls.symgraph,
+                                        cls.structure)
 
-    formula = sat.ClusteringCSP(signatures, symgraph, structure)
+        cls.solution = cls.formula.solve()
 
     def test_sat(self):
         """
         Test that the formula we have constructed is in fact satisfiable
         """
 
-        self.assertTrue(TestClusteringCSP.formula.solve())
+        self.assertTrue(TestClusteringCSP.solution)
 
     def test_injection(self):
         """
@@ -58,15 +69,19 @@ class TestClusteringCSP(unittest.TestCase):
         each methyl receives at most one assignment
         """
 
-        solution = TestClusteringCSP.formula.solve()
-        vertex_asg = [(alpha, beta) for vtype, alpha, beta in solution
-                      if vtype == sat.Formula.ASG_VAR]
+        solution = TestClusteringCSP.solution
+        asg_by_sig = collections.Counter(
+            alpha for vtype, alpha, beta in solution
+            if vtype == sat.Formula.ASG_VAR)
+        asg_by_met = collections.Counter(
+            beta for vtype, alpha, beta in solution
+            if vtype == sat.Formula.ASG_VAR)
 
         for s in TestClusteringCSP.signatures:
-            self.assertEqual(len([1 for a, b in vertex_asg if a == s]), 1)
+            self.assertEqual(asg_by_sig[s], 1)
 
         for m in TestClusteringCSP.structure.nodes():
-            self.assertTrue(len([1 for a, b in vertex_asg if b == m]) <= 1)
+            self.assertLessEqual(asg_by_met[m], 1)
 
     def test_respect_matching(self):
         """
@@ -74,18 +89,24 @@ class TestClusteringCSP(unittest.TestCase):
         """
 
         active_graph = TestClusteringCSP.symgraph.active_graph()
-        solution = TestClusteringCSP.formula.solve()
+        solution = TestClusteringCSP.solution
         active_edges = [(alpha, beta) for vtype, alpha, beta in solution
                         if vtype == sat.Formula.ACT_VAR]
 
-        # Iterate over the active complex components of the symgraph
+        # Group the activated edges by the active complex component of the
+        # symgraph that they lie in
 
-        for cc in nx.connected_component_subgraphs(active_graph):
+        component = {}
+        for idx, nodes in enumerate(nx.connected_components(active_graph)):
+            component.update(dict.fromkeys(nodes, idx))
 
-            edges = [(a, b) for a, b in active_edges if a in cc.nodes()
-                     and b in cc.nodes()]
+        edges = collections.defaultdict(list)
+        for a, b in active_edges:
+            if a in component and component[a] == component.get(b):
+                edges[component[a]].append((a, b))
 
-            self.assertTrue(nx.is_matching(cc, edges))
+        for matching in edges.values():
+            self.assertTrue(nx.is_matching(active_graph, matching))
 
     def test_clustering(self):
         """
@@ -93,14 +114,14 @@ class TestClusteringCSP(unittest.TestCase):
         """
 
         active_graph = TestClusteringCSP.symgraph.active_graph()
-        solution = TestClusteringCSP.formula.solve()
-        clustering = [(alpha, beta) for vtype, alpha, beta in solution
-                      if vtype == sat.Formula.CST_VAR]
+        solution = TestClusteringCSP.solution
+        clustering = collections.Counter(
+            alpha for vtype, alpha, beta in solution
+            if vtype == sat.Formula.CST_VAR)
 
         for node in active_graph.nodes():
             if len(node.clusters) > 1:
-                self.assertEqual(len([1 for a, b in clustering if a == node]),
-                                 1)
+                self.assertEqual(clustering[node], 1)
 
     def test_respect_active_edges(self):
         """
@@ -108,7 +129,7 @@ class TestClusteringCSP(unittest.TestCase):
         """
 
         active_graph = TestClusteringCSP.symgraph.active_graph()
-        solution = TestClusteringCSP.formula.solve()
+        solution = TestClusteringCSP.solution
 
         assignment = {alpha: beta for vtype, alpha, beta in solution
                       if vtype == sat.Formula.ASG_VAR}
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+test_ground.py
+
+Run tests on the ground truth checks
+"""
+
+import random
+import pandas
+import unittest
+import itertools
+import networkx as nx
+import camera.hmqc as hmqc
+import camera.noes as noes
+import camera.ground as ground
+import camera.structures as structures
+
+
+class TestGround(unittest.TestCase):
+    """
+    Run tests on the ground truth checks
+    """
+
+    def setUp(self):
+        """
+        Create a random structure in which every signature is assigned to a
+        single methyl, and a random component of NOEs clustered to them
+        """
+
+        random.seed(0)
+
+        # Create a structure with random distances between all methyls
+
+        methyls = [structures.Methyl("I", i, None) for i in range(8)]
+        self.structure = nx.Graph()
+        self.structure.add_nodes_from(methyls)
+
+        for i, j in itertools.combinations(methyls, 2):
+            self.structure.add_edge(i, j,
+                                    distances=[random.uniform(2., 20.)])
+
+        # Create one signature assigned to each methyl
+
+        self.signatures = []
+        for idx, m in enumerate(methyls):
+            s = hmqc.Signature(pandas.Series({"label": f"s{idx}",
+                                              "carbon": 10. + idx,
+                                              "hydrogen": 1.}))
+            s.asg = {m}
+            self.signatures.append(s)
+
+        # Create an NOE for each signature, clustered to that signature
+
+        self.crosspeaks = []
+        for idx, s in enumerate(self.signatures):
+            n = noes.Noe(pandas.Series({"label": f"n{idx}", "c1": 50. + idx,
+                                        "c2": s.carbon, "h2": 1.}))
+            n.clusters = [s]
+            self.crosspeaks.append(n)
+
+    def test_check_component(self):
+        """
+        Test that the bottleneck search agrees with enumerating every maximum
+        cardinality matching of the component
+        """
+
+        for trial in range(20):
+
+            component = nx.Graph()
+            for i, j in itertools.combinations(self.crosspeaks, 2):
+                if random.random() < 0.4:
+                    component.add_edge(i, j)
+
+            if not component.number_of_edges():
+                continue
+
+            size = len(nx.max_weight_matching(component, maxcardinality=True))
+
+            expected = float("inf")
+            for matching in itertools.combinations(component.edges(), size):
+                if nx.is_matching(component, matching):
+                    longest = max(ground.check_edge(i, j, self.structure)
+                                  for i, j in matching)
+                    expected = min(expected, longest)
+
+            self.assertEqual(ground.check_component(component, self.structure),
+                             expected)
+
+    def test_max_cardinality_matching(self):
+        """
+        Test that the matching found for bipartite and general graphs is a
+        matching as large as the one networkx finds
+        """
+
+        for trial in range(200):
+
+            if trial % 2:
+                graph = nx.bipartite.random_graph(4, 5, random.random(),
+                                                  seed=trial)
+            else:
+                graph = nx.gnp_random_graph(9, random.random(), seed=trial)
+
+            matching = ground.max_cardinality_matching(graph)
+            expected = nx.max_weight_matching(graph, maxcardinality=True)
+
+            self.assertTrue(nx.is_matching(graph, matching))
+            self.assertEqual(len(matching), len(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
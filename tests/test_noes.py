@@ -5,8 +5,10 @@ test_clustering_csp.py
 Run tests on the clustering CSP
 """
 
+import random
 import pandas
 import unittest
+import itertools
 import camera.noes as noes
 
 
@@ -47,6 +49,36 @@ class TestNoes(unittest.TestCase):
 
         self.assertFalse(n1.symmetric(n2))
 
+    def test_symmetric_pairs(self):
+        """
+        Test that the windowed symmetry search finds exactly the pairs that
+        are symmetric
+        """
+
+        random.seed(0)
+
+        peaks = []
+        for idx in range(300):
+
+            noe = {"label": f"p{idx}", "c1": random.uniform(18., 22.),
+                   "c2": random.uniform(18., 22.), "h2": random.uniform(0., 1.),
+                   "short": random.random() < 0.2}
+
+            if idx % 2:
+                noe["h1"] = random.uniform(0., 1.)
+
+            try:
+                peaks.append(noes.Noe(pandas.Series(noe)))
+            except Warning:
+                pass
+
+        expected = [(i, j) for i, j
+                    in itertools.combinations(range(len(peaks)), 2)
+                    if peaks[i].symmetric(peaks[j])]
+
+        self.assertTrue(expected)
+        self.assertEqual(noes.symmetric_pairs(peaks), expected)
+
 
 if __name__ == "__main__":
     unittest.main()
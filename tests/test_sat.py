@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+test_sat.py
+
+Run tests on the formula encodings
+"""
+
+import unittest
+import itertools
+import camera.sat as sat
+
+
+class TestFormula(unittest.TestCase):
+    """
+    Run tests on the formula class
+    """
+
+    def models(self, formula, fixed):
+        """
+        Count by brute force the satisfying assignments of the formula which
+        agree with the given partial assignment
+        """
+
+        free = [v for v in range(1, formula.nvars + 1) if v not in fixed]
+        count = 0
+
+        for values in itertools.product([False, True], repeat=len(free)):
+
+            assignment = dict(fixed)
+            assignment.update(zip(free, values))
+
+            if all(any(assignment[abs(l)] == (l > 0) for l in clause)
+                   for clause in formula.base_clauses):
+                count += 1
+
+        return count
+
+    def satisfiable(self, formula, fixed):
+        """
+        Determine by brute force whether the formula has a satisfying
+        assignment which agrees with the given partial assignment
+        """
+
+        return self.models(formula, fixed) > 0
+
+    def test_at_most_one(self):
+        """
+        Test that at_most_one admits exactly the assignments to its literals
+        in which no more than one literal is True
+        """
+
+        for size in range(1, 8):
+
+            formula = sat.Formula()
+            lits = [formula.next_variable() for _ in range(size)]
+            formula.at_most_one(lits)
+
+            for values in itertools.product([False, True], repeat=size):
+                self.assertEqual(
+                    self.satisfiable(formula, dict(zip(lits, values))),
+                    sum(values) <= 1)
+
+    def test_at_most_one_models(self):
+        """
+        Test that at_most_one leaves its auxiliary variables fully determined,
+        so that each admitted assignment to its literals has exactly one model
+        """
+
+        for size in range(1, 9):
+
+            formula = sat.Formula()
+            lits = [formula.next_variable() for _ in range(size)]
+            formula.at_most_one(lits)
+
+            for values in itertools.product([False, True], repeat=size):
+                if sum(values) <= 1:
+                    self.assertEqual(
+                        self.models(formula, dict(zip(lits, values))), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()